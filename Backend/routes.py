@@ -1,15 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Body, HTTPException
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from server import MCP, OUTPUT_DIR
+from starlette.background import BackgroundTask
+from server import MCP, MaxBodySizeMiddleware, MAX_REQUEST_BODY_BYTES, OUTPUT_DIR, DOWNLOAD_CHUNK_SIZE, FILE_EXPIRATION_SECONDS, admission, NGINX_ACCEL_PREFIX, THREADPOOL_MAX_WORKERS, cleanup_old_files_periodically, openai_http_client, sse_encoder, generator_pool, SSE_DRAIN_BATCH, normalize_conversion_id
 import time
 from sse_starlette.sse import EventSourceResponse
-import json
 import asyncio
+import anyio.to_thread
+import aiofiles.os
+import uuid
+from contextlib import suppress
+from pathlib import Path
 from typing import Optional
 
 # Initialize FastAPI app
-app = FastAPI(title="VB6 to .NET Converter", version="2.0.6", description="Convert VB6 projects to .NET 9 Worker Services with enhanced SSE streaming and download endpoint")
+app = FastAPI(title="VB6 to .NET Converter", version="2.0.6", description="Convert VB6 projects to .NET 9 Worker Services with enhanced SSE streaming and download endpoint", default_response_class=ORJSONResponse)
+
+# Cap request bodies; added before CORS so CORS wraps it and 413 responses still carry CORS headers
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=MAX_REQUEST_BODY_BYTES)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,9 +28,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize MCP
+# Shared facade for the log broker, artifacts and settings; each /convert runs its own MCP pipeline
 mcp = MCP()
 
+@app.on_event("startup")
+async def startup():
+    # Known before any client subscribes, so events logged from worker threads are always handed to this loop
+    mcp.log_broker.loop = asyncio.get_running_loop()
+    # /download and blocking upload I/O run in anyio's threadpool, which defaults to 40 workers
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_MAX_WORKERS
+    app.state.cleanup_task = asyncio.create_task(cleanup_old_files_periodically())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.cleanup_task.cancel()
+    if generator_pool is not None:
+        generator_pool.shutdown(wait=False, cancel_futures=True)
+    await openai_http_client.aclose()
+
 @app.get("/")
 async def root():
     return {
@@ -40,21 +63,57 @@ async def health():
         "azure_openai": "configured" if mcp.is_openai_configured() else "not configured"
     }
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "sse_subscribers": len(mcp.log_broker.subs),
+        "sse_dropped_events": mcp.log_broker.dropped,
+        "active_conversions": admission.active,
+        "max_concurrent_conversions": admission.capacity
+    }
+
+@app.get("/config/concurrency")
+async def get_concurrency():
+    return {"max_concurrent_conversions": admission.capacity, "active_conversions": admission.active}
+
+@app.put("/config/concurrency")
+async def set_concurrency(max_concurrent_conversions: int = Body(..., embed=True)):
+    if max_concurrent_conversions < 1:
+        raise HTTPException(status_code=400, detail="max_concurrent_conversions must be at least 1")
+    await admission.set_capacity(max_concurrent_conversions)
+    return {"max_concurrent_conversions": admission.capacity, "active_conversions": admission.active}
+
 @app.post("/convert")
 async def convert_vb6_to_dotnet(
     zip_file: Optional[UploadFile] = File(None),
-    github_link: Optional[str] = Form(None)
+    github_link: Optional[str] = Form(None),
+    conversion_id: Optional[str] = Form(None)
 ):
     if not zip_file and not github_link:
         raise HTTPException(status_code=400, detail="Please provide either a ZIP file or GitHub repository link")
-    start_time = time.time()
+    # A client-chosen id lets it open /stream?conversion_id=... before the conversion starts
+    conversion_id = normalize_conversion_id(conversion_id) if conversion_id else str(uuid.uuid4())
+    start_time = time.monotonic()
+    # Agents hold per-run state, so each conversion gets its own pipeline
+    pipeline = MCP()
     try:
-        conversion_task = asyncio.create_task(mcp.run(zip_file, github_link))
-        result_data, conversion_id = await asyncio.wait_for(conversion_task, timeout=mcp.CONVERSION_TIMEOUT_SECONDS)
-        duration = time.time() - start_time
-        output_file_path = OUTPUT_DIR / f"{conversion_id}.zip"
-        with open(output_file_path, 'wb') as f:
-            f.write(result_data)
+        # Starlette already spooled the upload; ZipFile reads that file object directly
+        if zip_file:
+            await zip_file.seek(0)
+        async with admission:
+            conversion_task = asyncio.create_task(pipeline.run(zip_file.file if zip_file else None, github_link, conversion_id))
+            try:
+                # Shield so the timeout doesn't cancel implicitly; the task is cancelled, awaited and cleaned up below
+                output_path, conversion_id = await asyncio.wait_for(asyncio.shield(conversion_task), timeout=mcp.CONVERSION_TIMEOUT_SECONDS)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                conversion_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await conversion_task
+                await pipeline.cleanup_partial(conversion_id)
+                raise
+        duration = time.monotonic() - start_time
+        output_file_path = Path(output_path)
+        mcp._artifacts[conversion_id] = {"path": output_file_path, "stat": await aiofiles.os.stat(output_file_path)}
         mcp.logger.info(f"Conversion completed successfully in {duration:.2f} seconds", extra={"stage": "pipeline", "progress": 100})
         return {
             "status": "success",
@@ -64,13 +123,13 @@ async def convert_vb6_to_dotnet(
             "download_url": f"/download/{conversion_id}"
         }
     except asyncio.TimeoutError:
-        duration = time.time() - start_time
+        duration = time.monotonic() - start_time
         mcp.logger.error(f"Conversion timed out after {duration:.2f} seconds", extra={"stage": "pipeline"})
         raise HTTPException(status_code=504, detail="Conversion process timed out")
     except HTTPException:
         raise
     except Exception as e:
-        duration = time.time() - start_time
+        duration = time.monotonic() - start_time
         mcp.logger.error(f"Conversion failed after {duration:.2f} seconds: {str(e)}", extra={"stage": "pipeline"})
         raise HTTPException(
             status_code=500,
@@ -78,58 +137,94 @@ async def convert_vb6_to_dotnet(
         )
 
 @app.get("/download/{conversion_id}")
-async def download_converted_file(conversion_id: str):
-    file_path = OUTPUT_DIR / f"{conversion_id}.zip"
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found or expired")
-    if file_path.stat().st_size == 0:
-        file_path.unlink()
+async def download_converted_file(conversion_id: str, request: Request):
+    artifact = mcp._artifacts.get(conversion_id)
+    if artifact and time.time() - artifact["stat"].st_mtime <= FILE_EXPIRATION_SECONDS:
+        file_path, stat_result = artifact["path"], artifact["stat"]
+    else:
+        # Not converted by this process (or already expired), so fall back to the filesystem
+        mcp._artifacts.pop(conversion_id, None)
+        file_path = OUTPUT_DIR / f"{conversion_id}.zip"
+        try:
+            stat_result = await aiofiles.os.stat(file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found or expired")
+    if stat_result.st_size == 0:
+        mcp._artifacts.pop(conversion_id, None)
+        await aiofiles.os.remove(file_path)
         raise HTTPException(status_code=500, detail="File is empty")
-    try:
+    if NGINX_ACCEL_PREFIX:
+        # nginx serves the file after this handler returns, so it is left for cleanup_old_files
+        return Response(
+            status_code=200,
+            headers={
+                "X-Accel-Redirect": f"{NGINX_ACCEL_PREFIX.rstrip('/')}/{conversion_id}.zip",
+                "Content-Disposition": 'attachment; filename="MyWindowsService.zip"',
+                "Content-Type": "application/zip"
+            }
+        )
+    if "http.response.pathsend" in request.scope.get("extensions", {}):
+        # The ASGI server streams the file itself (sendfile(2)), so no bytes are copied through Python
         return FileResponse(
             file_path,
+            media_type="application/zip",
             filename="MyWindowsService.zip",
-            headers={"Content-Disposition": "attachment; filename=MyWindowsService.zip"}
+            stat_result=stat_result,
+            background=BackgroundTask(delete_downloaded_file, conversion_id, file_path)
         )
-    except Exception as e:
-        mcp.logger.error(f"Error serving file {conversion_id}: {str(e)}", extra={"stage": "download"})
-        raise HTTPException(status_code=500, detail=f"Error serving file: {str(e)}")
-    finally:
+
+    async def file_iterator():
         try:
-            file_path.unlink(missing_ok=True)
-            mcp.logger.info(f"Deleted downloaded file: {file_path}", extra={"stage": "download"})
+            async with aiofiles.open(file_path, 'rb') as f:
+                while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
         except Exception as e:
-            mcp.logger.error(f"Failed to delete file {file_path}: {str(e)}", extra={"stage": "download"})
+            mcp.logger.error(f"Error serving file {conversion_id}: {str(e)}", extra={"stage": "download"})
+            raise
+
+    return StreamingResponse(
+        file_iterator(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=MyWindowsService.zip",
+            "Content-Length": str(stat_result.st_size)
+        },
+        background=BackgroundTask(delete_downloaded_file, conversion_id, file_path)
+    )
+
+def delete_downloaded_file(conversion_id: str, file_path):
+    """Runs in the threadpool once the response body has been fully sent."""
+    mcp._artifacts.pop(conversion_id, None)
+    try:
+        file_path.unlink(missing_ok=True)
+        mcp.logger.info(f"Deleted downloaded file: {file_path}", extra={"stage": "download"})
+    except Exception as e:
+        mcp.logger.error(f"Failed to delete file {file_path}: {str(e)}", extra={"stage": "download"})
 
 @app.get("/stream")
-async def stream_conversion_progress():
+async def stream_conversion_progress(conversion_id: Optional[str] = None):
+    """Stream pipeline events; with the conversion_id given to /convert, only that conversion's."""
+    if conversion_id:
+        conversion_id = normalize_conversion_id(conversion_id)
+
     async def event_generator():
-        while True:
-            try:
-                event = await asyncio.wait_for(mcp.log_queue.get(), timeout=30.0)
-                yield {
-                    "event": event.get("event_type", "log"),
-                    "data": json.dumps({
-                        "message": event.get("message", ""),
-                        "level": event.get("level", "INFO"),
-                        "timestamp": event.get("timestamp", time.time()),
-                        "stage": event.get("stage", "unknown"),
-                        "agent": event.get("agent", None),
-                        "state": event.get("state", None),
-                        "current_agent": event.get("current_agent", None),
-                        "progress": event.get("progress", 0),
-                        "details": event.get("details", {})
-                    })
-                }
-                if event.get("stage") == "pipeline" and event.get("state") in ["Completed", "Failed"]:
-                    break
-            except asyncio.TimeoutError:
-                yield {
-                    "event": "ping",
-                    "data": json.dumps({
-                        "message": "Keep-alive ping",
-                        "timestamp": time.time(),
-                        "progress": mcp.sse_handler.progress
-                    })
-                }
-    return EventSourceResponse(event_generator())
\ No newline at end of file
+        # Disconnects are detected by EventSourceResponse, which cancels this generator
+        queue = mcp.log_broker.subscribe(conversion_id)
+        try:
+            while not mcp.log_broker.is_slow(queue):
+                # Drain whatever else is already queued before going back to wait on the queue
+                batch = [await queue.get()]
+                while len(batch) < SSE_DRAIN_BATCH and not queue.empty():
+                    batch.append(queue.get_nowait())
+                for event in batch:
+                    yield {
+                        "event": event.event_type,
+                        "data": sse_encoder.encode(event).decode()
+                    }
+                    if event.stage == "pipeline" and event.state in ["Completed", "Failed"]:
+                        return
+            mcp.logger.warning("SSE client too slow, dropping connection", extra={"stage": "streaming"})
+        finally:
+            mcp.log_broker.unsubscribe(queue)
+    # Keep-alives are sent by EventSourceResponse as ": ping" comments, so idle clients hold no timer of their own
+    return EventSourceResponse(event_generator(), ping=15)
@@ -1,20 +1,22 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 import tempfile
 import zipfile
 import yaml
-import json
+import orjson
+import msgspec
 import asyncio
 from git import Repo
 import dspy
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+import httpx
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Union, BinaryIO, Callable
 from pydantic import BaseModel
-import io
+from dataclasses import dataclass
+from functools import lru_cache
 import time
 import re
 from sse_starlette.sse import EventSourceResponse
@@ -23,7 +25,22 @@ from typing import Dict, Optional
 from datetime import datetime
 import uuid
 import threading
-from fastapi.responses import StreamingResponse
+import contextvars
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import anyio.to_thread
+from collections import OrderedDict, defaultdict, deque
+import string
+import hashlib
+import aiofiles
+import aiofiles.os
+import diskcache
+import tiktoken
+from pathlib import Path
+from urllib.parse import urlparse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, ORJSONResponse
+from starlette.background import BackgroundTask
 
 
 
@@ -38,14 +55,127 @@ class AgentState(Enum):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One SSE payload; a C-backed struct is cheaper to build per log call and encodes straight to JSON
+class SSEEvent(msgspec.Struct):
+    message: str
+    level: str
+    timestamp: float
+    stage: str
+    agent: Optional[str] = None
+    state: Optional[str] = None
+    current_agent: Optional[str] = None
+    progress: int = 0
+    details: dict = {}
+    event_type: str = "log"
+    conversion_id: Optional[str] = None
+
+sse_encoder = msgspec.json.Encoder()
+
+# Conversion the current task (or worker thread, via asyncio.to_thread) is logging on behalf of
+current_conversion_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_conversion_id", default=None)
+
+# Fan-out broker: a subscriber receives either one conversion's events or, with no conversion_id, every event
+class LogBroker:
+    def __init__(self, max_queue_size: int, replay_size: int):
+        self.max_queue_size = max_queue_size
+        self.replay_size = replay_size
+        self.subs: Dict[asyncio.Queue, deque] = {}  # subscriber queue -> timestamps of recent drops
+        self._topics: Dict[Optional[str], set] = defaultdict(set)  # conversion_id (None: all of them) -> subscriber queues
+        self.recent: Dict[str, deque] = {}  # in-flight conversion_id -> its recent events, for replay
+        self.finished: OrderedDict = OrderedDict()  # recently finished conversion ids, oldest first
+        self.dropped = 0
+        self._slow = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, conversion_id: Optional[str] = None) -> asyncio.Queue:
+        """Register a new subscriber queue, pre-filled with the recent events of the conversion(s) it follows."""
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subs[queue] = deque(maxlen=SSE_SLOW_CLIENT_DROPS)
+        self._topics[conversion_id].add(queue)
+        if conversion_id is None:
+            replay = heapq.merge(*self.recent.values(), key=lambda event: event.timestamp)
+        else:
+            replay = self.recent.get(conversion_id, ())
+        for event in replay:
+            self._put(queue, event)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subs.pop(queue, None)
+        self._slow.discard(queue)
+        for conversion_id, queues in list(self._topics.items()):
+            queues.discard(queue)
+            if not queues:
+                del self._topics[conversion_id]
+
+    def reopen(self, conversion_id: str):
+        """Accept events for conversion_id again, e.g. when a client retries with the same id."""
+        self.finished.pop(conversion_id, None)
+
+    def is_finished(self, conversion_id: Optional[str]) -> bool:
+        return conversion_id is not None and conversion_id in self.finished
+
+    def is_slow(self, queue: asyncio.Queue) -> bool:
+        return queue in self._slow
+
+    async def stream(self, conversion_id: Optional[str] = None):
+        """Yield events to one subscriber the moment they are published, until it falls too far behind."""
+        queue = self.subscribe(conversion_id)
+        try:
+            while not self.is_slow(queue):
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue)
+
+    def publish(self, event: SSEEvent):
+        """Non-blocking publish; a full subscriber queue drops its oldest event."""
+        # A timed-out or cancelled run's worker thread/process can keep logging; don't let it re-create state
+        if self.is_finished(event.conversion_id):
+            return
+        targets = list(self._topics.get(None, ()))
+        if event.conversion_id is not None:
+            targets.extend(self._topics.get(event.conversion_id, ()))
+            recent = self.recent.get(event.conversion_id)
+            if recent is None:
+                recent = self.recent[event.conversion_id] = deque(maxlen=self.replay_size)
+            recent.append(event)
+            # Only conversions still in flight are replayed
+            if event.stage == "pipeline" and event.state in (AgentState.COMPLETED.value, AgentState.FAILED.value):
+                del self.recent[event.conversion_id]
+                self.finished[event.conversion_id] = None
+                if len(self.finished) > SSE_FINISHED_IDS:
+                    self.finished.popitem(last=False)
+        for queue in targets:
+            self._put(queue, event)
+
+    def _put(self, queue: asyncio.Queue, event: SSEEvent):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if event.event_type == "state_update":
+                # Never silently lose a state transition: drop the subscriber instead, it gets a replay on reconnect
+                self._slow.add(queue)
+                return
+            queue.get_nowait()
+            queue.put_nowait(event)
+            self.dropped += 1
+            drops = self.subs.get(queue)
+            if drops is None:
+                return
+            now = time.monotonic()
+            drops.append(now)
+            if len(drops) == drops.maxlen and now - drops[0] <= SSE_SLOW_CLIENT_WINDOW_SECONDS:
+                self._slow.add(queue)
+
 # Custom logging handler for SSE streaming
 class SSELogHandler(logging.Handler):
     def __init__(self):
         super().__init__()
-        self.queue = asyncio.Queue()
-        self.progress = 0
+        self.broker = LogBroker(SSE_MAX_QUEUE_SIZE, SSE_REPLAY_SIZE)
+        self.progress = 0  # Of the most recently emitted event
         self.total_stages = 6
-        self.completed_stages = set()  # Track completed stages
+        self.completed_stages: Dict[Optional[str], set] = {}  # conversion_id -> stages completed so far
 
     def emit(self, record):
         try:
@@ -54,40 +184,53 @@ class SSELogHandler(logging.Handler):
             stage = getattr(record, 'stage', 'general')
             state = getattr(record, 'state', None)
             agent = getattr(record, 'agent', None)
-
-            # Update progress only for new stage completions
-            if event_type == "state_update" and state == AgentState.COMPLETED.value and stage not in self.completed_stages:
-                self.progress = min(self.progress + (100 // self.total_stages), 100)
-                self.completed_stages.add(stage)
-
-            log_entry = {
-                "event_type": event_type,
-                "level": record.levelname,
-                "message": msg,
-                "timestamp": time.time(),
-                "stage": stage,
-                "agent": agent,
-                "state": state,
-                "progress": self.progress,
-                "details": {
-                    "stage_progress": self._get_stage_progress(stage, state)
-                }
-            }
-            print("Emitting SSE:", log_entry)  # Debug log
-            self.queue.put_nowait(log_entry)
+            conversion_id = getattr(record, 'conversion_id', None) or current_conversion_id.get()
+            if self.broker.is_finished(conversion_id):
+                return
+
+            # Progress counts distinct completed stages, separately for each conversion
+            completed_stages = self.completed_stages.setdefault(conversion_id, set())
+            if event_type == "state_update" and state == AgentState.COMPLETED.value:
+                completed_stages.add(stage)
+            self.progress = min(len(completed_stages) * (100 // self.total_stages), 100)
+            if stage == "pipeline" and state in (AgentState.COMPLETED.value, AgentState.FAILED.value):
+                self.completed_stages.pop(conversion_id, None)
+
+            log_entry = SSEEvent(
+                message=msg,
+                level=record.levelname,
+                timestamp=time.time(),
+                stage=stage,
+                agent=agent,
+                state=state,
+                progress=self.progress,
+                details={"stage_progress": self._get_stage_progress(stage, state)},
+                event_type=event_type,
+                conversion_id=conversion_id
+            )
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # Logged from a worker thread (e.g. code generation): asyncio queues may only be touched on their loop,
+                # so hand the event over, or drop it if there is no loop (e.g. a generator pool process)
+                if self.broker.loop is not None and not self.broker.loop.is_closed():
+                    self.broker.loop.call_soon_threadsafe(self.broker.publish, log_entry)
+                return
+            self.broker.publish(log_entry)
         except Exception:
             self.handleError(record)
 
+    STAGE_WEIGHTS = {
+        "ingestor": 10,
+        "parser": 30,
+        "context_analyzer": 20,
+        "summarizer": 10,
+        "generator": 20,
+        "filebuilder": 10
+    }
+
     def _get_stage_progress(self, stage: str, state: Optional[str]) -> float:
-        stage_weights = {
-            "ingestor": 10,
-            "parser": 30,
-            "context_analyzer": 20,
-            "summarizer": 10,
-            "generator": 20,
-            "filebuilder": 10
-        }
-        return stage_weights.get(stage.lower(), 10) if state == AgentState.COMPLETED.value else 50 if state == AgentState.RUNNING.value else 0
+        return self.STAGE_WEIGHTS.get(stage.lower(), 10) if state == AgentState.COMPLETED.value else 50 if state == AgentState.RUNNING.value else 0
 
 # Load environment variables
 load_dotenv()
@@ -104,13 +247,152 @@ for var in required_env_vars:
         raise EnvironmentError(f"Missing required environment variable: {var}")
 
 # Configuration
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
+AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", 50))
 MAX_CODE_LENGTH = int(os.getenv("MAX_CODE_LENGTH", 100000))
-ALLOWED_GITHUB_DOMAINS = ["github.com"]
+ALLOWED_GITHUB_DOMAINS = frozenset({"github.com", "www.github.com"})
 MAX_FILES = int(os.getenv("MAX_FILES", 50))
+VB6_EXTENSIONS = frozenset({'.frm', '.bas', '.cls', '.vbp'})
+# libyaml-backed loader/dumper when PyYAML was built against it; the pure-Python safe classes otherwise
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+# What the summarizer hands on when it fails; dumped once rather than on every failure
+EMPTY_SUMMARY_YAML = yaml.dump({'procedures': [], 'events': [], 'globals': [], 'dependencies': [], 'main_logic': {}, 'metadata': {}, 'file_count': 0}, Dumper=YAML_DUMPER)
+# Zip-bomb guards, checked against the central directory before anything is inflated
+MAX_ZIP_ENTRIES = int(os.getenv("MAX_ZIP_ENTRIES", 10000))
+MAX_EXTRACTED_BYTES = int(os.getenv("MAX_EXTRACTED_MB", 200)) * 1024 * 1024
+SSE_MAX_QUEUE_SIZE = int(os.getenv("SSE_MAX_QUEUE_SIZE", 1000))
+SSE_SLOW_CLIENT_DROPS = int(os.getenv("SSE_SLOW_CLIENT_DROPS", 100))
+SSE_SLOW_CLIENT_WINDOW_SECONDS = float(os.getenv("SSE_SLOW_CLIENT_WINDOW_SECONDS", 10))
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", 200))
+# How many finished conversion ids to remember so late worker logs for them can be dropped
+SSE_FINISHED_IDS = int(os.getenv("SSE_FINISHED_IDS", 1024))
+# Events already queued for a subscriber are sent in runs of up to this many per wakeup
+SSE_DRAIN_BATCH = int(os.getenv("SSE_DRAIN_BATCH", 32))
+LLM_STREAM_LOG_INTERVAL = float(os.getenv("LLM_STREAM_LOG_INTERVAL", 2))
+THREADPOOL_MAX_WORKERS = int(os.getenv("THREADPOOL_MAX_WORKERS", 200))
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", 4))
+PARSER_CONCURRENCY = int(os.getenv("PARSER_CONCURRENCY", 8))
+# Worker processes for code generation (CPU-bound); 0 keeps it on a thread in this process
+GENERATOR_PROCESSES = int(os.getenv("GENERATOR_PROCESSES", 0))
+# Multipart framing adds a little on top of the ZIP itself
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_MB", MAX_FILE_SIZE_MB + 1)) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Deflate level for the generated project ZIP (0-9); 1 trades a little size for several times the speed
+ZIP_COMPRESSLEVEL = int(os.getenv("ZIP_COMPRESSLEVEL", 1))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CONVERSION_TIMEOUT_SECONDS = int(os.getenv("CONVERSION_TIMEOUT_SECONDS", 600))
+GITHUB_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("GITHUB_DOWNLOAD_TIMEOUT_SECONDS", 120))
+# Keep on a local filesystem: /download relies on sendfile(2), which FUSE and some network mounts fall back from
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+FILE_EXPIRATION_SECONDS = int(os.getenv("FILE_EXPIRATION_SECONDS", 3600))
+# When set, /download hands the file off to nginx instead of streaming it through Python, e.g.
+#   location /_internal_output/ { internal; alias /path/to/OUTPUT_DIR/; sendfile on; tcp_nopush on; }
+NGINX_ACCEL_PREFIX = os.getenv("NGINX_ACCEL_PREFIX", "")
+PARSE_CACHE_TTL_SECONDS = int(os.getenv("PARSE_CACHE_TTL_SECONDS", 86400))
+
+# Content-addressed cache of LLM analysis results, keyed by prompt hash + model. Lookups are SQLite I/O,
+# so callers go through asyncio.to_thread (diskcache.Cache is thread-safe)
+parse_cache = diskcache.Cache(str(OUTPUT_DIR / ".parse_cache"))
+
+def llm_cache_key(model: str, prompt: str) -> str:
+    return f"{hashlib.blake2b(prompt.encode('utf-8')).hexdigest()}:{model}"
+
+# Prompt input budgets in tokens; prompts plus max_tokens=4096 of output stay well inside the model context
+PARSER_CODE_TOKENS = int(os.getenv("PARSER_CODE_TOKENS", 4000))
+CONTEXT_DATA_TOKENS = int(os.getenv("CONTEXT_DATA_TOKENS", 2000))
+# Character budget per token used when the tokenizer is unavailable (the old 8000-char / 4000-token cut)
+FALLBACK_CHARS_PER_TOKEN = 2
+
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    """Load the o200k_base encoding on first use; None if it can't be fetched or found in TIKTOKEN_CACHE_DIR."""
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"Token encoding unavailable, falling back to character-based truncation: {e}", extra={"stage": "parser"})
+        return None
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, on a token boundary rather than mid-character."""
+    token_encoding = get_token_encoding()
+    if token_encoding is None:
+        return text[:max_tokens * FALLBACK_CHARS_PER_TOKEN]
+    tokens = token_encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return token_encoding.decode(tokens[:max_tokens])
+
+VB6_PROCEDURE_RE = re.compile(
+    r'^[ \t]*(?:(?:Public|Private|Friend)\s+)?(?:Static\s+)?(?:Sub|Function|Property\s+(?:Get|Let|Set))\s+\w+',
+    re.MULTILINE | re.IGNORECASE
+)
+
+def chunk_vb6_code(code: str, max_tokens: int) -> List[str]:
+    """Split VB6 source at procedure boundaries into pieces of at most max_tokens tokens each.
+
+    The declarations section stays with the first procedures; a single procedure larger than
+    the budget becomes its own chunk and is truncated by the parser prompt as before.
+    """
+    token_encoding = get_token_encoding()
+    starts = [m.start() for m in VB6_PROCEDURE_RE.finditer(code)]
+    bounds = [0] + [pos for pos in starts if pos > 0] + [len(code)]
+    chunks, current, current_tokens = [], [], 0
+    for begin, end in zip(bounds, bounds[1:]):
+        segment = code[begin:end]
+        if token_encoding is None:
+            segment_tokens = -(-len(segment) // FALLBACK_CHARS_PER_TOKEN)
+        else:
+            segment_tokens = len(token_encoding.encode(segment, disallowed_special=()))
+        if current and current_tokens + segment_tokens > max_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += segment_tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+# ASGI middleware capping request body size
+class MaxBodySizeMiddleware:
+    """Reject oversized request bodies before they are spooled to disk.
+
+    Declared Content-Length is checked up front; chunked bodies are counted as they arrive.
+    """
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
 
 # Initialize FastAPI app
-app = FastAPI(title="VB6 to .NET Converter", version="2.0.4", description="Convert VB6 projects to .NET 9 Worker Services with enhanced SSE streaming")
+app = FastAPI(title="VB6 to .NET Converter", version="2.0.4", description="Convert VB6 projects to .NET 9 Worker Services with enhanced SSE streaming", default_response_class=ORJSONResponse)
+
+# Cap request bodies; added before CORS so CORS wraps it and 413 responses still carry CORS headers
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=MAX_REQUEST_BODY_BYTES)
 
 # Add CORS middleware
 app.add_middleware(
@@ -123,12 +405,50 @@ app.add_middleware(
 
 conversion_status = {}
 
+# Admission control for conversions
+class AdmissionController:
+    """Caps concurrent conversions; unlike asyncio.Semaphore the limit can be resized at runtime."""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.capacity)
+            self.active += 1
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify(1)
+
+    async def set_capacity(self, capacity: int):
+        async with self._cond:
+            self.capacity = capacity
+            self._cond.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+admission = AdmissionController(MAX_CONCURRENT_CONVERSIONS)
+
 # Azure OpenAI client setup
-openai_client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+# One pooled HTTP client so TCP/TLS connections to Azure are reused across LLM calls
+openai_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+    timeout=120.0,
+)
+openai_client = AsyncAzureOpenAI(
+    api_key=AZURE_OPENAI_API_KEY,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    api_version=AZURE_OPENAI_API_VERSION,
     timeout=120.0,
+    http_client=openai_http_client,
 )
 
 # SSE logging setup
@@ -137,6 +457,16 @@ formatter = logging.Formatter('%(message)s')
 sse_handler.setFormatter(formatter)
 logger.addHandler(sse_handler)
 
+# Precompiled patterns
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9]')
+GITHUB_LINK_UNSAFE_RE = re.compile(r'[^a-zA-Z0-9:/.-]')
+# Deletes every ASCII non-alphanumeric; str.translate runs in C, NON_ALNUM_RE covers non-ASCII names
+NON_ALNUM_ASCII_TABLE = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isalnum()))
+CSHARP_STRING_LITERAL_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"')
+# Assignment (=, +=, ...) but not ==, !=, <=, >=, =>; or ++/--
+CSHARP_MUTATION_RE = re.compile(r'(?<![=!<>])=(?![=>])|\+\+|--')
+
 # Fixed JSON cleaning function
 def clean_json_response(response: str) -> str:
     """Clean and fix common JSON issues from AI responses."""
@@ -144,51 +474,192 @@ def clean_json_response(response: str) -> str:
         return response
     
     try:
-        response = re.sub(r'```', '', response)
-        response = re.sub(r'```\s*$', '', response)
-        response = re.sub(r'^```', '', response)
-        response = re.sub(r'```', '', response)
+        response = response.replace('```', '')
         first_brace = response.find('{')
-        if first_brace > 0:
-            response = response[first_brace:]
         last_brace = response.rfind('}')
-        if last_brace > 0:
-            response = response[:last_brace + 1]
-        response = re.sub(r',\s*}', '}', response)
-        response = re.sub(r',\s*]', ']', response)
+        if first_brace != -1 and last_brace > first_brace:
+            response = response[first_brace:last_brace + 1]
+        response = TRAILING_COMMA_RE.sub(r'\1', response)
         return response.strip()
     except Exception as e:
         logger.error(f"Error cleaning JSON response: {e}", extra={"stage": "json_cleaning"})
         return response
 
+# conversion_id -> {"path", "stat"} of finished ZIPs awaiting download, shared by every MCP instance
+conversion_artifacts: Dict[str, dict] = {}
+
+def delete_expired_zips(current_time: float) -> Tuple[List[str], List[str]]:
+    """Remove expired ZIPs (and .zip.part leftovers of crashed writes) in one scandir pass, reusing each DirEntry's stat; returns (deleted, errors)."""
+    deleted, errors = [], []
+    with os.scandir(OUTPUT_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith((".zip", ".zip.part")):
+                continue
+            try:
+                if current_time - entry.stat().st_mtime > FILE_EXPIRATION_SECONDS:
+                    os.unlink(entry.path)
+                    deleted.append(entry.path)
+            except OSError as e:
+                errors.append(f"{entry.path}: {e}")
+    return deleted, errors
+
+async def cleanup_old_files():
+    """Delete converted ZIPs in OUTPUT_DIR older than FILE_EXPIRATION_SECONDS, off the event loop."""
+    current_time = time.time()
+    deleted, errors = await asyncio.to_thread(delete_expired_zips, current_time)
+    # Expired ZIPs that were never downloaded would otherwise keep their entries forever
+    expired_ids = [conversion_id for conversion_id, artifact in conversion_artifacts.items()
+                   if current_time - artifact["stat"].st_mtime > FILE_EXPIRATION_SECONDS]
+    for conversion_id in expired_ids:
+        conversion_artifacts.pop(conversion_id, None)
+    for file_path in deleted:
+        logger.info(f"Deleted expired file: {file_path}", extra={"stage": "cleanup"})
+    for error in errors:
+        logger.error(f"Failed to delete expired file {error}", extra={"stage": "cleanup"})
+
+async def cleanup_old_files_periodically():
+    """Sweep OUTPUT_DIR every quarter of the expiration window for the lifetime of the app."""
+    while True:
+        try:
+            await cleanup_old_files()
+        except Exception as e:
+            logger.error(f"Cleanup sweep failed: {e}", extra={"stage": "cleanup"})
+        await asyncio.sleep(FILE_EXPIRATION_SECONDS / 4)
+
+def extract_zip_safely(zip_source: Union[str, BinaryIO], dest_dir: str, on_extract: Optional[Callable[[str], None]] = None):
+    """Extract the VB6 sources in zip_source (a path or a seekable file object) into dest_dir.
+
+    Archives with entries that would land outside dest_dir, too many entries, or VB6 sources that
+    would inflate past MAX_EXTRACTED_BYTES are refused before any data is decompressed. When given,
+    on_extract is called with the path of each source as soon as it is written.
+    """
+    with zipfile.ZipFile(zip_source, 'r') as zip_ref:
+        infolist = zip_ref.infolist()
+        if len(infolist) > MAX_ZIP_ENTRIES:
+            raise ValueError(f"ZIP file has too many entries. Maximum: {MAX_ZIP_ENTRIES}")
+        dest_root = os.path.abspath(dest_dir)
+        dest_prefix = dest_root + os.sep
+        members = []
+        for info in infolist:
+            target = os.path.normpath(os.path.join(dest_prefix, info.filename))
+            if target != dest_root and not target.startswith(dest_prefix):
+                raise ValueError("Path traversal detected in ZIP file")
+            if os.path.splitext(info.filename)[1].lower() in VB6_EXTENSIONS:
+                members.append(info)
+        if sum(info.file_size for info in members) > MAX_EXTRACTED_BYTES:
+            raise ValueError(f"ZIP file expands beyond {MAX_EXTRACTED_BYTES // (1024 * 1024)}MB of VB6 sources")
+        if on_extract is None:
+            zip_ref.extractall(dest_dir, members=members)
+            return
+        for info in members:
+            extracted = zip_ref.extract(info, dest_dir)
+            if not info.is_dir():
+                on_extract(extracted)
+
+async def download_github_archive(github_link: str, dest_path: str) -> bool:
+    """Fetch the default branch of a GitHub repository as a ZIP archive.
+
+    Returns False when the archive can't be used (unrecognised link, HTTP error, or larger than
+    MAX_FILE_SIZE_MB) so the caller can fall back to git clone.
+    """
+    parts = [part for part in urlparse(github_link).path.split('/') if part]
+    if len(parts) < 2:
+        return False
+    owner, repo = parts[0], parts[1].removesuffix('.git')
+    archive_url = f"https://github.com/{owner}/{repo}/archive/HEAD.zip"
+    max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    received = 0
+    try:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=GITHUB_DOWNLOAD_TIMEOUT_SECONDS) as client:
+            async with client.stream("GET", archive_url) as response:
+                if response.status_code != 200:
+                    logger.warning(f"GitHub archive download returned {response.status_code}, falling back to git clone", extra={"stage": "ingestor"})
+                    return False
+                async with aiofiles.open(dest_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                        received += len(chunk)
+                        if received > max_bytes:
+                            logger.warning(f"GitHub archive exceeds {MAX_FILE_SIZE_MB}MB, falling back to git clone", extra={"stage": "ingestor"})
+                            return False
+                        await f.write(chunk)
+        return True
+    except httpx.HTTPError as e:
+        logger.warning(f"GitHub archive download failed, falling back to git clone: {e}", extra={"stage": "ingestor"})
+        return False
+
+def find_vb6_files(root_dir: str) -> List[dict]:
+    """Collect the VB6 sources under root_dir; os.walk is scandir-based, so no extra stat per file."""
+    vb6_files = []
+    for root, _, files in os.walk(root_dir):
+        for fname in files:
+            if os.path.splitext(fname)[1].lower() in VB6_EXTENSIONS:
+                vb6_files.append({"path": os.path.join(root, fname), "name": fname})
+    return vb6_files
+
+def normalize_conversion_id(conversion_id: str) -> str:
+    """Canonical form of a client-supplied conversion id; it names files in OUTPUT_DIR, so only UUIDs are accepted."""
+    try:
+        return str(uuid.UUID(conversion_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="conversion_id must be a UUID")
+
 # Custom Azure OpenAI wrapper
 class CustomAzureOpenAI(dspy.Module):
     def __init__(self, model: str):
         super().__init__()
         self.model = model
 
-    def forward(self, **kwargs):
+    async def forward(self, **kwargs):
         prompt = kwargs.get("prompt")
+        stream = kwargs.get("stream", False)
+        stage = kwargs.get("stage", "ai_processing")
         max_retries = 5
         for attempt in range(max_retries):
             try:
-                response = openai_client.chat.completions.create(
+                response = await openai_client.chat.completions.create(
                     model=self.model,
                     messages=[
                         {"role": "system", "content": "You are a precise JSON generator and expert VB6 to C# converter. Always return valid JSON without markdown, code fences, or extra text. Ensure all strings are properly escaped and the JSON is well-formed."},
                         {"role": "user", "content": prompt},
                     ],
                     temperature=0.1,
-                    max_tokens=4096
+                    max_tokens=4096,
+                    stream=stream
                 )
-                return response.choices[0].message.content
+                if not stream:
+                    return response.choices[0].message.content
+                return await self._collect_stream(response, stage)
             except Exception as e:
                 logger.error(f"Azure OpenAI error (attempt {attempt+1}/{max_retries}): {e}", extra={"stage": "ai_processing"})
                 if attempt < max_retries - 1:
-                    time.sleep(min(2 ** attempt, 30))
+                    await asyncio.sleep(min(2 ** attempt, 30))
                 else:
                     raise
 
+    async def _collect_stream(self, response, stage: str) -> str:
+        """Accumulate streamed deltas, reporting progress over SSE at most every LLM_STREAM_LOG_INTERVAL seconds."""
+        parts = []
+        received = 0
+        last_report = time.monotonic()
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                received += len(delta)
+            now = time.monotonic()
+            if now - last_report >= LLM_STREAM_LOG_INTERVAL:
+                logger.info(f"Receiving model output: {received} characters", extra={"stage": stage})
+                last_report = now
+        return ''.join(parts)
+
+# One LM wrapper shared by every DSPy module, so all LLM calls go through openai_client's connection pool
+shared_lm = CustomAzureOpenAI(model=AZURE_OPENAI_DEPLOYMENT_NAME)
+# One permit per in-flight parser LLM call (each chunk of a large file takes its own), shared by every
+# conversion so the cap holds process-wide and stays under Azure rate limits
+parser_semaphore = asyncio.Semaphore(PARSER_CONCURRENCY)
+
 # Pydantic models
 class CodeFilesModel(BaseModel):
     MyWindowsService_csproj: str
@@ -198,14 +669,46 @@ class CodeFilesModel(BaseModel):
     appsettings_Development_json: str
     Properties__launchSettings_json: str
 
+# CodeFilesModel field -> path inside the generated project
+PROJECT_FILE_NAMES = {
+    "MyWindowsService_csproj": "MyWindowsService.csproj",
+    "Program_cs": "Program.cs",
+    "Worker_cs": "Worker.cs",
+    "appsettings_json": "appsettings.json",
+    "appsettings_Development_json": "appsettings.Development.json",
+    "Properties__launchSettings_json": "Properties/launchSettings.json",
+}
+
 # Enhanced DSPy Modules
 class ParserModule(dspy.Module):
     def __init__(self):
         super().__init__()
-        self.lm = CustomAzureOpenAI(model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"))
+        self.lm = shared_lm
 
-    def forward(self, code: str, file_name: str) -> dict:
+    async def forward(self, code: str, file_name: str) -> dict:
         logger.info("Starting VB6 code parsing", extra={"stage": "parser"})
+        # A token spans at least one character, so short files skip tokenization entirely
+        if len(code) <= PARSER_CODE_TOKENS:
+            return await self._forward_chunk(code, file_name)
+        # Tokenizing and chunking large files is CPU work; tiktoken releases the GIL, so a thread keeps the loop free
+        chunks = await asyncio.to_thread(chunk_vb6_code, code, PARSER_CODE_TOKENS)
+        if len(chunks) == 1:
+            return await self._forward_chunk(code, file_name)
+        # Too large for one prompt: parse each procedure-aligned chunk concurrently (one parser_semaphore permit each) and merge
+        logger.info(f"Splitting {file_name} into {len(chunks)} chunks for parsing", extra={"stage": "parser"})
+        results = await asyncio.gather(*(self._forward_chunk(chunk, file_name) for chunk in chunks))
+        merged = {"procedures": [], "events": [], "globals": [], "dependencies": [], "main_logic": {}, "metadata": {}}
+        for result in results:
+            for key in ("procedures", "events", "globals", "dependencies"):
+                merged[key].extend(result.get(key) or [])
+            merged["main_logic"] = merged["main_logic"] or result.get("main_logic") or {}
+            merged["metadata"] = {**result.get("metadata", {}), **merged["metadata"]}
+        merged["metadata"]["total_lines"] = len(code.splitlines())
+        return merged
+
+    async def _forward_chunk(self, code: str, file_name: str) -> dict:
+        # Tokenizing is CPU work, so it runs in a thread like the chunking above
+        code_text = code if len(code) <= PARSER_CODE_TOKENS else await asyncio.to_thread(truncate_to_tokens, code, PARSER_CODE_TOKENS)
         prompt = f"""You are an expert VB6 code analyst. Analyze this VB6 code and extract ALL procedures, functions, events, and relevant context information for C# conversion.
 
 Extract and return ONLY a valid JSON object with this structure:
@@ -267,20 +770,27 @@ Extract and return ONLY a valid JSON object with this structure:
 Extract ALL procedures, functions, and event handlers (e.g., Form_Load, Command1_Click, Timer1_Timer) with their full code bodies, parameters, and metadata. Identify the module/form context, track line numbers, and capture the application's primary entry point and processing pattern. For .frm files, prioritize event handlers and Form-related procedures. Ensure event handlers are correctly identified by their naming convention (e.g., ControlName_EventName).
 
 VB6 Code to analyze:
-{code[:8000]}"""
+{code_text}"""
         
+        cache_key = llm_cache_key(self.lm.model, prompt)
+        cached = await asyncio.to_thread(parse_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"Using cached parse result for {file_name}", extra={"stage": "parser"})
+            return cached
         try:
-            raw = self.lm.forward(prompt=prompt)
+            async with parser_semaphore:
+                raw = await self.lm.forward(prompt=prompt)
             if raw:
                 cleaned = clean_json_response(raw)
-                result = json.loads(cleaned)
+                result = orjson.loads(cleaned)
                 result['metadata']['total_lines'] = len(code.splitlines())
+                await asyncio.to_thread(parse_cache.set, cache_key, result, expire=PARSE_CACHE_TTL_SECONDS)
                 logger.info(f"Successfully parsed VB6 code: {len(result.get('procedures', []))} procedures, {len(result.get('events', []))} events", extra={"stage": "parser"})
                 return result
             else:
                 logger.error("Empty response from AI", extra={"stage": "parser"})
                 return {"procedures": [], "events": [], "globals": [], "dependencies": [], "main_logic": {}, "metadata": {"file_name": file_name, "module_type": "Unknown", "total_lines": len(code.splitlines())}}
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"JSON parsing error in ParserModule: {e}. Raw response: {raw[:200] if raw else 'None'}", extra={"stage": "parser"})
             return {"procedures": [], "events": [], "globals": [], "dependencies": [], "main_logic": {}, "metadata": {"file_name": file_name, "module_type": "Unknown", "total_lines": len(code.splitlines())}}
         except Exception as e:
@@ -345,10 +855,14 @@ def update_conversion_status(conversion_id: str, step_name: str, status: str):
 class ContextAnalyzerModule(dspy.Module):
     def __init__(self):
         super().__init__()
-        self.lm = CustomAzureOpenAI(model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"))
+        self.lm = shared_lm
 
-    def forward(self, parsed_results: List[dict]) -> dict:
+    async def forward(self, parsed_results: List[dict]) -> dict:
         logger.info("Starting context analysis", extra={"stage": "context_analyzer"})
+        # Serializing and tokenizing every parse result is CPU work; keep it off the event loop
+        context_data = await asyncio.to_thread(
+            lambda: truncate_to_tokens(orjson.dumps(parsed_results, option=orjson.OPT_INDENT_2).decode(), CONTEXT_DATA_TOKENS)
+        )
         prompt = f"""Analyze VB6 parsed data to create a comprehensive context map for the entire application, identifying primary modules and processing flows.
 
 Return ONLY a valid JSON object with this structure:
@@ -399,59 +913,33 @@ Return ONLY a valid JSON object with this structure:
 Incorporate ALL parsed procedures, events, and globals across all modules. Identify the main module/form by prioritizing .frm files or modules with Form_Load events, then modules with the most procedures. Track procedure calls between modules, map the application's processing flow, and identify event-driven patterns from event handlers.
 
 Parsed VB6 Data:
-{json.dumps(parsed_results, indent=2)[:4000]}"""
+{context_data}"""
         
+        cache_key = llm_cache_key(self.lm.model, prompt)
+        cached = await asyncio.to_thread(parse_cache.get, cache_key)
+        if cached is not None:
+            logger.info("Using cached context analysis", extra={"stage": "context_analyzer"})
+            return cached
         try:
-            raw = self.lm.forward(prompt=prompt)
+            raw = await self.lm.forward(prompt=prompt, stream=True, stage="context_analyzer")
             if raw:
                 cleaned = clean_json_response(raw)
-                result = json.loads(cleaned)
+                result = orjson.loads(cleaned)
+                await asyncio.to_thread(parse_cache.set, cache_key, result, expire=PARSE_CACHE_TTL_SECONDS)
                 logger.info("Successfully analyzed VB6 context", extra={"stage": "context_analyzer"})
                 return result
             else:
                 logger.error("Empty response from AI", extra={"stage": "context_analyzer"})
                 return {"application_type": "Service", "main_workflow": {}, "data_flow": [], "state_management": {}, "communication": {}, "timing_patterns": {}, "module_hierarchy": {}}
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"JSON parsing error in ContextAnalyzerModule: {e}. Raw response: {raw[:200] if raw else 'None'}", extra={"stage": "context_analyzer"})
             return {"application_type": "Service", "main_workflow": {}, "data_flow": [], "state_management": {}, "communication": {}, "timing_patterns": {}, "module_hierarchy": {}}
         except Exception as e:
             logger.error(f"ContextAnalyzerModule forward error: {e}", extra={"stage": "context_analyzer"})
             return {"application_type": "Service", "main_workflow": {}, "data_flow": [], "state_management": {}, "communication": {}, "timing_patterns": {}, "module_hierarchy": {}}
 
-class GeneratorModule(dspy.Module):
-    def __init__(self):
-        super().__init__()
-        self.lm = CustomAzureOpenAI(model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"))
-
-    def forward(self, yaml_summary: str, context_map: dict) -> dict:
-        logger.info("Starting code generation", extra={"stage": "generator"})
-        try:
-            summary_data = yaml.safe_load(yaml_summary)
-            procedures = summary_data.get('procedures', [])
-            globals_list = summary_data.get('globals', [])
-            main_logic = summary_data.get('main_logic', {})
-            metadata = summary_data.get('metadata', {})
-            
-            logger.info(f"Generating Worker.cs with {len(procedures)} procedures and {len(globals_list)} globals", extra={"stage": "generator"})
-            
-            result = self._build_complete_project(
-                self._generate_comprehensive_worker(procedures, globals_list, context_map, main_logic, metadata)
-            )
-            logger.info("Code generation completed", extra={"stage": "generator"})
-            return result
-        except Exception as e:
-            logger.error(f"Error parsing YAML summary: {e}", extra={"stage": "generator"})
-            return self._build_complete_project(self._get_enhanced_worker_template(yaml_summary, context_map))
-
-    def _generate_comprehensive_worker(self, procedures: List, globals_list: List, context_map: dict, main_logic: dict, metadata: dict) -> str:
-        logger.info("Generating comprehensive Worker.cs", extra={"stage": "generator"})
-        fields_code = self._generate_fields(globals_list)
-        methods_code = self._generate_methods(procedures, context_map)
-        execute_async_code = self._generate_execute_async(procedures, main_logic, context_map)
-        primary_module = main_logic.get('primary_module', 'ConvertedService')
-        namespace = f"{self._sanitize_namespace(primary_module)}Namespace"
-        
-        return f"""using Microsoft.Extensions.Hosting;
+# Worker.cs skeleton; only the ${...} slots vary per conversion, so C# braces need no escaping
+WORKER_CS_TEMPLATE = string.Template("""using Microsoft.Extensions.Hosting;
 using Microsoft.Extensions.Logging;
 using System;
 using System.Threading;
@@ -461,14 +949,14 @@ using System.Text;
 using System.IO;
 using System.Linq;
 
-namespace {namespace};
+namespace ${namespace};
 
 public class Worker : BackgroundService
-{{
+{
     private readonly ILogger<Worker> _logger;
     
     // VB6 Converted Global Variables
-{fields_code}
+${fields_code}
     
     // Processing state fields
     private bool _isProcessing;
@@ -479,16 +967,16 @@ public class Worker : BackgroundService
     private readonly object _lockObject = new object();
 
     public Worker(ILogger<Worker> logger)
-    {{
+    {
         _logger = logger;
         _random = new Random();
         ClassInitialize();
-    }}
+    }
 
     private void ClassInitialize()
-    {{
+    {
         lock (_lockObject)
-        {{
+        {
             _cmd = 0;
             _req = 0;
             _tout = 30000;
@@ -501,35 +989,35 @@ public class Worker : BackgroundService
             _msgData = new byte[_bc];
             _maskData = new byte[_bc];
             
-            {self._generate_field_initializations(globals_list)}
+            ${field_initializations}
             
             _isProcessing = false;
             _lastProcessTime = DateTime.Now;
             _processedCount = 0;
             _errorCount = 0;
             
-            _logger.LogInformation("VB6 Worker Service initialized with {{procedureCount}} procedures and {{globalCount}} globals", {len(procedures)}, {len(globals_list)});
-        }}
-    }}
+            _logger.LogInformation("VB6 Worker Service initialized with {procedureCount} procedures and {globalCount} globals", ${procedure_count}, ${global_count});
+        }
+    }
 
-{execute_async_code}
+${execute_async_code}
 
-{methods_code}
+${methods_code}
 
     private async Task ProcessMainWorkflow(CancellationToken stoppingToken)
-    {{
+    {
         if (_isProcessing)
-        {{
+        {
             _logger.LogDebug("Already processing, skipping cycle");
             return;
-        }}
+        }
 
         _isProcessing = true;
         var cycleStart = DateTime.Now;
         
         try
-        {{
-            _logger.LogInformation("Starting VB6 processing cycle #{{count}}", _processedCount + 1);
+        {
+            _logger.LogInformation("Starting VB6 processing cycle #{count}", _processedCount + 1);
             
             await ExecuteVB6Procedures(stoppingToken);
             
@@ -538,66 +1026,66 @@ public class Worker : BackgroundService
             _errorCount = Math.Max(0, _errorCount - 1);
             
             var cycleDuration = DateTime.Now - cycleStart;
-            _logger.LogInformation("Completed VB6 cycle #{{count}} in {{duration}}ms", 
+            _logger.LogInformation("Completed VB6 cycle #{count} in {duration}ms", 
                 _processedCount, cycleDuration.TotalMilliseconds);
-        }}
+        }
         catch (OperationCanceledException) when (stoppingToken.IsCancellationRequested)
-        {{
+        {
             _logger.LogInformation("Processing cancelled due to service shutdown");
             throw;
-        }}
+        }
         catch (Exception ex)
-        {{
+        {
             _errorCount++;
-            _logger.LogError(ex, "Error in processing cycle #{{count}}", _processedCount);
+            _logger.LogError(ex, "Error in processing cycle #{count}", _processedCount);
             
             var errorDelay = Math.Min(5000 * _errorCount, 30000);
             await Task.Delay(errorDelay, stoppingToken);
-        }}
+        }
         finally
-        {{
+        {
             _isProcessing = false;
-        }}
-    }}
+        }
+    }
 
     private async Task ExecuteVB6Procedures(CancellationToken stoppingToken)
-    {{
+    {
         try
-        {{
-            {self._generate_procedure_calls(procedures, context_map)}
+        {
+            ${procedure_calls}
             
             await Task.Delay(50, stoppingToken);
-        }}
+        }
         catch (Exception ex)
-        {{
+        {
             _logger.LogError(ex, "Error executing VB6 procedures");
-        }}
-    }}
+        }
+    }
 
     private async Task PerformCleanup()
-    {{
+    {
         _logger.LogInformation("Performing VB6 service cleanup...");
         
         try
-        {{
+        {
             lock (_lockObject)
-            {{
+            {
                 _isProcessing = false;
                 
                 if (_msgData != null) Array.Clear(_msgData, 0, _msgData.Length);
                 if (_maskData != null) Array.Clear(_maskData, 0, _maskData.Length);
-            }}
+            }
             
-            _logger.LogInformation("VB6 Final statistics - Processed: {{processed}}, Errors: {{errors}}", 
+            _logger.LogInformation("VB6 Final statistics - Processed: {processed}, Errors: {errors}", 
                 _processedCount, _errorCount);
             
             await Task.Delay(100);
-        }}
+        }
         catch (Exception ex)
-        {{
+        {
             _logger.LogError(ex, "Error during VB6 cleanup");
-        }}
-    }}
+        }
+    }
 
     public int ByteCount() => _bc;
     public long ByteCountLong() => _bcLong;
@@ -611,174 +1099,581 @@ public class Worker : BackgroundService
     public int IntMetaDataByteCount() => _mintMetaDataBC;
 
     public void SetCommand(byte command)
-    {{
+    {
         lock (_lockObject)
-        {{
+        {
             _cmd = command;
-            _logger.LogDebug("Command set to: {{cmd}}", command);
-        }}
-    }}
+            _logger.LogDebug("Command set to: {cmd}", command);
+        }
+    }
 
     public void SetTimeout(long timeout)
-    {{
+    {
         lock (_lockObject)
-        {{
+        {
             _tout = Math.Max(1000, timeout);
-            _logger.LogDebug("Timeout set to: {{timeout}}ms", _tout);
-        }}
-    }}
+            _logger.LogDebug("Timeout set to: {timeout}ms", _tout);
+        }
+    }
 
     public void ResetCounters()
-    {{
+    {
         lock (_lockObject)
-        {{
+        {
             _processedCount = 0;
             _errorCount = 0;
             _bc = 30000;
             _bcLong = 30000;
             _logger.LogInformation("VB6 Counters reset");
-        }}
-    }}
+        }
+    }
 
     public int GetProcessedCount() => _processedCount;
     public int GetErrorCount() => _errorCount;
     public bool IsProcessing() => _isProcessing;
     public DateTime GetLastProcessTime() => _lastProcessTime;
-}}
+}
 
 public class ValueResult
-{{
-    public double Value {{ get; set; }}
-    public bool IsValid {{ get; set; }} = true;
-    public DateTime ComputedAt {{ get; set; }} = DateTime.Now;
-    public string ParameterName {{ get; set; }} = string.Empty;
-    public string Units {{ get; set; }} = string.Empty;
-    public int Precision {{ get; set; }}
-    public Dictionary<string, object> AdditionalData {{ get; set; }} = new Dictionary<string, object>();
-}}
+{
+    public double Value { get; set; }
+    public bool IsValid { get; set; } = true;
+    public DateTime ComputedAt { get; set; } = DateTime.Now;
+    public string ParameterName { get; set; } = string.Empty;
+    public string Units { get; set; } = string.Empty;
+    public int Precision { get; set; }
+    public Dictionary<string, object> AdditionalData { get; set; } = new Dictionary<string, object>();
+}
 
 public class ReturnCode
-{{
-    public int Code {{ get; set; }}
-    public string Message {{ get; set; }} = string.Empty;
-    public bool IsSuccess {{ get; set; }}
-    public DateTime Timestamp {{ get; set; }} = DateTime.Now;
+{
+    public int Code { get; set; }
+    public string Message { get; set; } = string.Empty;
+    public bool IsSuccess { get; set; }
+    public DateTime Timestamp { get; set; } = DateTime.Now;
     
-    public static ReturnCode Success {{ get; }} = new ReturnCode {{ Code = 0, Message = "Success", IsSuccess = true }};
-    public static ReturnCode Failure {{ get; }} = new ReturnCode {{ Code = -1, Message = "Failure", IsSuccess = false }};
+    public static ReturnCode Success { get; } = new ReturnCode { Code = 0, Message = "Success", IsSuccess = true };
+    public static ReturnCode Failure { get; } = new ReturnCode { Code = -1, Message = "Failure", IsSuccess = false };
     
     public static ReturnCode Error(int code, string message)
-    {{
-        return new ReturnCode {{ Code = code, Message = message, IsSuccess = false }};
-    }}
-}}
+    {
+        return new ReturnCode { Code = code, Message = message, IsSuccess = false };
+    }
+}
 
 public enum SeriesDirections
-{{
+{
     Increasing = 0,
     Decreasing = 1,
     Constant = 2,
     Random = 3
-}}
-"""
+}
+""")
 
-    def _sanitize_namespace(self, name: str) -> str:
-        """Sanitize module name for use in C# namespace."""
-        return re.sub(r'[^a-zA-Z0-9]', '', name) or "ConvertedService"
+# Worker.cs used when generation fails; only ${namespace} varies
+FALLBACK_WORKER_CS_TEMPLATE = string.Template("""using Microsoft.Extensions.Hosting;
+using Microsoft.Extensions.Logging;
+using System;
+using System.Threading;
+using System.Threading.Tasks;
 
-    def _generate_fields(self, globals_list: List) -> str:
-        logger.info("Generating fields from globals", extra={"stage": "generator"})
-        fields = []
-        standard_fields = [
-            "    private int _bc = 30000;",
-            "    private long _bcLong = 30000;",
-            "    private byte _cmd = 0;",
-            "    private byte _req = 0;",
-            "    private long _tout = 30000;",
-            "    private long _mlngMetaDataTout = 60000;",
-            "    private byte _mbytMetaDataReq = 0;",
-            "    private int _mintMetaDataBC = 0;",
-            "    private byte[] _msgData;",
-            "    private byte[] _maskData;"
-        ]
-        fields.extend(standard_fields)
-        seen_fields = set(field.split('=')[0].strip().split()[-1].strip(';') for field in standard_fields)
-        for global_var in globals_list:
-            if isinstance(global_var, dict):
-                name = global_var.get('name', '')
-                var_type = global_var.get('type', 'object')
-                default_value = global_var.get('default_value', '')
-                module_name = global_var.get('module_name', '')
-                if name:
-                    field_name = f"_{self._to_camel_case(f'{module_name}_{name}' if module_name else name)}"
-                    if field_name not in seen_fields:
-                        csharp_type = self._convert_vb6_type_to_csharp(var_type)
-                        csharp_default = self._convert_vb6_default_to_csharp(default_value, csharp_type)
-                        fields.append(f"    private {csharp_type} {field_name}{csharp_default};")
-                        seen_fields.add(field_name)
-        return '\n'.join(fields)
+namespace ${namespace};
 
-    def _generate_field_initializations(self, globals_list: List) -> str:
-        initializations = []
-        seen_fields = set()
-        for global_var in globals_list:
-            if isinstance(global_var, dict):
-                name = global_var.get('name', '')
-                default_value = global_var.get('default_value', '')
-                var_type = global_var.get('type', 'object')
-                module_name = global_var.get('module_name', '')
-                if name and default_value:
-                    field_name = f"_{self._to_camel_case(f'{module_name}_{name}' if module_name else name)}"
-                    if field_name not in seen_fields:
-                        csharp_type = self._convert_vb6_type_to_csharp(var_type)
-                        csharp_value = self._convert_vb6_default_to_csharp(default_value, csharp_type)
-                        if csharp_value and not csharp_value.startswith(' = '):
-                            initializations.append(f"            {field_name} = {csharp_value};")
-                            seen_fields.add(field_name)
-        return '\n'.join(initializations) if initializations else "            // No additional initialization required"
+public class Worker : BackgroundService
+{
+    private readonly ILogger<Worker> _logger;
+    private int _bc = 30000;
+    private long _bcLong = 30000;
+    // Wrapping counters, bumped with Interlocked and read back as bytes
+    private int _cmdCounter;
+    private int _reqCounter;
+    private long _tout = 30000;
+    private long _mlngMetaDataTout = 60000;
+    private byte _mbytMetaDataReq = 0;
+    private int _mintMetaDataBC = 0;
+    private readonly object _lockObject = new object();
 
-    def _generate_methods(self, procedures: List, context_map: dict) -> str:
-        methods = []
-        standard_methods = [
-            """    public void SetServeParameters(object newServeParameters)
+    public Worker(ILogger<Worker> logger)
     {
-        _logger.LogInformation("VB6 SetServeParameters called with: {params}", newServeParameters);
-        lock (_lockObject)
-        {
-            if (newServeParameters != null)
-            {
-                _cmd = (byte)((_cmd + 1) % 256);
-                _req = (byte)((_req + 1) % 256);
-                _logger.LogDebug("Parameters updated - Command: {cmd}, Request: {req}", _cmd, _req);
-            }
-        }
-    }""",
-            """    public void ReinitializeValueCache()
+        _logger = logger;
+        ClassInitialize();
+    }
+
+    private void ClassInitialize()
     {
-        _logger.LogInformation("VB6 ReinitializeValueCache called");
         lock (_lockObject)
         {
+            Volatile.Write(ref _cmdCounter, 0);
+            Volatile.Write(ref _reqCounter, 0);
+            _tout = 30000;
             _bc = 30000;
-            _bcLong = 30000;
-            if (_msgData != null) Array.Clear(_msgData, 0, _msgData.Length);
-            if (_maskData != null) Array.Clear(_maskData, 0, _maskData.Length);
-            _logger.LogDebug("Value cache reinitialized");
+            _logger.LogInformation("VB6 Worker Service initialized");
         }
-    }""",
-            """    public ReturnCode GetComputedResult(string parameterXYZName, ref ValueResult valResult, 
-        int recordNumber = 0, int precision = 0, SeriesDirections seriesDirection = SeriesDirections.Increasing, 
-        bool summation = false)
+    }
+
+    protected override async Task ExecuteAsync(CancellationToken stoppingToken)
     {
-        _logger.LogInformation("VB6 GetComputedResult called - Parameter: {param}, Record: {record}", 
-            parameterXYZName, recordNumber);
-        try
+        _logger.LogInformation("VB6 Converted Worker Service started at: {time}", DateTimeOffset.Now);
+        
+        while (!stoppingToken.IsCancellationRequested)
         {
-            lock (_lockObject)
+            try
             {
-                valResult = new ValueResult 
-                { 
-                    Value = _random.NextDouble() * 100 + recordNumber,
-                    IsValid = true,
+                await ProcessVB6Logic(stoppingToken);
+                await Task.Delay(1000, stoppingToken);
+            }
+            catch (OperationCanceledException)
+            {
+                _logger.LogInformation("Operation was canceled");
+                break;
+            }
+            catch (Exception ex)
+            {
+                _logger.LogError(ex, "Error in VB6 processing");
+                await Task.Delay(5000, stoppingToken);
+            }
+        }
+        
+        _logger.LogInformation("VB6 Converted Worker Service stopped at: {time}", DateTimeOffset.Now);
+    }
+
+    private async Task ProcessVB6Logic(CancellationToken stoppingToken)
+    {
+        _logger.LogInformation("Processing VB6 logic - ByteCount: {bc}, Command: {cmd}", _bc, Command());
+        
+        Interlocked.Increment(ref _cmdCounter);
+        Interlocked.Increment(ref _reqCounter);
+        
+        await Task.Delay(100, stoppingToken);
+    }
+
+    public int ByteCount() => _bc;
+    public long ByteCountLong() => _bcLong;
+    public byte Command() => (byte)(Volatile.Read(ref _cmdCounter) & 0xFF);
+    public byte Request() => (byte)(Volatile.Read(ref _reqCounter) & 0xFF);
+    public long Timeout() => _tout;
+    public long LngMetaDataRequestTimeOut() => _mlngMetaDataTout;
+    public byte BytMetaDataRequest() => _mbytMetaDataReq;
+    public int IntMetaDataByteCount() => _mintMetaDataBC;
+
+    public void SetServeParameters(object newServeParameters)
+    {
+        _logger.LogInformation("VB6 SetServeParameters called");
+        if (newServeParameters != null)
+        {
+            Interlocked.Increment(ref _cmdCounter);
+        }
+    }
+
+    public void ReinitializeValueCache()
+    {
+        _logger.LogInformation("VB6 ReinitializeValueCache called");
+        lock (_lockObject)
+        {
+            _bc = 30000;
+            _bcLong = 30000;
+        }
+    }
+
+    public ReturnCode GetComputedResult(string parameterXYZName, ref ValueResult valResult, 
+        int recordNumber = 0, int precision = 0, SeriesDirections seriesDirection = SeriesDirections.Increasing, 
+        bool summation = false)
+    {
+        _logger.LogInformation("VB6 GetComputedResult called for parameter: {param}", parameterXYZName);
+        
+        try
+        {
+            valResult = new ValueResult 
+            { 
+                Value = new Random().NextDouble() * 100,
+                IsValid = true,
+                ParameterName = parameterXYZName
+            };
+            
+            return ReturnCode.Success;
+        }
+        catch (Exception ex)
+        {
+            _logger.LogError(ex, "Error in GetComputedResult");
+            valResult = new ValueResult { IsValid = false };
+            return ReturnCode.Failure;
+        }
+    }
+}
+
+public class ValueResult
+{
+    public double Value { get; set; }
+    public bool IsValid { get; set; }
+    public string ParameterName { get; set; } = string.Empty;
+}
+
+public enum ReturnCode
+{
+    Success,
+    Failure
+}
+
+public enum SeriesDirections
+{
+    Increasing,
+    Decreasing
+}
+""")
+
+# Project files that are identical for every conversion
+CSPROJ_CONTENT = """<Project Sdk="Microsoft.NET.Sdk.Worker">
+  <PropertyGroup>
+    <TargetFramework>net9.0</TargetFramework>
+    <Nullable>enable</Nullable>
+    <ImplicitUsings>enable</ImplicitUsings>
+    <UserSecretsId>dotnet-MyWindowsService-$(MSBuildProjectName)</UserSecretsId>
+    <UseAppHost>true</UseAppHost>
+    <PublishSingleFile>true</PublishSingleFile>
+    <SelfContained>true</SelfContained>
+  </PropertyGroup>
+  <ItemGroup>
+    <PackageReference Include="Microsoft.Extensions.Hosting" Version="9.0.0" />
+    <PackageReference Include="Microsoft.Extensions.Hosting.WindowsServices" Version="9.0.0" />
+    <PackageReference Include="Microsoft.Extensions.Logging.Console" Version="9.0.0" />
+    <PackageReference Include="Microsoft.Extensions.Logging.EventLog" Version="9.0.0" />
+  </ItemGroup>
+</Project>"""
+
+PROGRAM_CS_CONTENT = """using MyWindowsService;
+using Microsoft.Extensions.Logging.Configuration;
+using Microsoft.Extensions.Logging.EventLog;
+
+var builder = Host.CreateApplicationBuilder(args);
+
+// Configure logging
+builder.Logging.ClearProviders();
+builder.Logging.AddConsole();
+
+// Add Windows Event Log if running on Windows
+if (OperatingSystem.IsWindows())
+{
+    builder.Logging.AddEventLog();
+}
+
+// Add the worker service
+builder.Services.AddHostedService<Worker>();
+
+// Configure Windows Service
+builder.Services.AddWindowsService(options =>
+{
+    options.ServiceName = "VB6 Converted Service";
+});
+
+var host = builder.Build();
+
+try
+{
+    await host.RunAsync();
+}
+catch (Exception ex)
+{
+    var logger = host.Services.GetRequiredService<ILogger<Program>>();
+    logger.LogCritical(ex, "Application terminated unexpectedly");
+    throw;
+}"""
+
+APPSETTINGS_JSON_CONTENT = """{
+  "Logging": {
+    "LogLevel": {
+      "Default": "Information",
+      "Microsoft.Hosting.Lifetime": "Information",
+      "MyWindowsService": "Information"
+    },
+    "Console": {
+      "IncludeScopes": true,
+      "TimestampFormat": "yyyy-MM-dd HH:mm:ss "
+    },
+    "EventLog": {
+      "LogLevel": {
+        "Default": "Warning"
+      }
+    }
+  },
+  "WorkerSettings": {
+    "ProcessingIntervalMs": 1000,
+    "TimeoutMs": 30000,
+    "MaxRetries": 50
+  }
+}"""
+
+APPSETTINGS_DEVELOPMENT_JSON_CONTENT = """{
+  "logging": {
+    "logLevel": {
+      "default": "Debug",
+      "Microsoft.Hosting.Lifetime": "Information",
+      "MyWindowsService": "Debug"
+    }
+  }
+}"""
+
+LAUNCH_SETTINGS_JSON_CONTENT = """{
+  "profiles": {
+    "MyWindowsService": {
+      "commandName": "Project",
+      "dotnetRunMessages": true,
+      "environmentVariables": {
+        "DOTNET_ENVIRONMENT": "Development"
+      }
+    },
+    "MyWindowsService (Production)": {
+      "commandName": "Project",
+      "dotnetRunMessages": false,
+      "environmentVariables": {
+        "DOTNET_ENVIRONMENT": "Production"
+      }
+    }
+  }
+}"""
+
+
+def compile_token_alternation(tokens) -> re.Pattern:
+    """Compile one longest-first alternation over literal tokens, anchored at word boundaries where a token starts or ends with a word character."""
+    parts = []
+    for token in sorted(tokens, key=len, reverse=True):
+        pattern = re.escape(token)
+        if token[0].isalnum() or token[0] == '_':
+            pattern = r'\b' + pattern
+        if token[-1].isalnum() or token[-1] == '_':
+            pattern += r'\b'
+        parts.append(pattern)
+    return re.compile('|'.join(parts))
+
+# VB6 keyword/operator rewrites applied to procedure bodies in a single regex pass
+VB6_KEYWORD_REPLACEMENTS = {
+    'Dim ': 'var ',
+    ' As Integer': '',
+    ' As String': '',
+    ' As Boolean': '',
+    ' As Long': '',
+    ' As Byte': '',
+    'Set ': '',
+    'Nothing': 'null',
+    'True': 'true',
+    'False': 'false',
+    'And': '&&',
+    'Or': '||',
+    'Not ': '!',
+    '<>': '!=',
+    '&': '+',
+}
+VB6_KEYWORD_RE = compile_token_alternation(VB6_KEYWORD_REPLACEMENTS)
+
+# Type and return-value tables shared by the generator helpers
+VB6_TO_CSHARP_TYPES = {
+    'Integer': 'int',
+    'String': 'string',
+    'Boolean': 'bool',
+    'Long': 'long',
+    'Byte': 'byte',
+    'Single': 'float',
+    'Double': 'double',
+    'Currency': 'decimal',
+    'Date': 'DateTime',
+    'Object': 'object',
+    'Variant': 'object',
+    'void': 'void'
+}
+CSHARP_DEFAULT_RETURNS = {
+    'int': '0',
+    'long': '0L',
+    'byte': '0',
+    'bool': 'true',
+    'string': 'string.Empty',
+    'float': '0.0f',
+    'double': '0.0',
+    'decimal': '0m'
+}
+CSHARP_TYPED_RETURNS = {
+    'int': '(int){v}',
+    'long': '(long){v}',
+    'byte': '(byte){v}',
+    'bool': '({v} != null && {v}.ToString() != "0")',
+    'string': '{v}?.ToString() ?? string.Empty'
+}
+
+@dataclass(frozen=True, slots=True)
+class ImplTemplate:
+    """Placeholder body for a procedure the parser returned without code."""
+    keywords: Tuple[str, ...]
+    body: str
+    result_var: Optional[str] = None  # returned through _get_typed_return; None returns the type's default
+    timer_aware: bool = False  # appends the Timer-pattern log line
+    needs_lock: bool = True  # False only for bodies that just read fields; System.Random is not thread-safe
+
+# Checked in order, so a name matching several keyword groups gets the first one
+REALISTIC_IMPL_TEMPLATES = (
+    ImplTemplate(('initialize', 'init'), '_logger.LogDebug("Initializing {{method}}...", "{name}");\n_cmd = 0;\n_req = 0;'),
+    ImplTemplate(('process', 'execute'), '_logger.LogDebug("Processing in {{method}}...", "{name}");\nawait Task.Delay(50);\n_processedCount++;', timer_aware=True),
+    ImplTemplate(('get', 'retrieve'), '_logger.LogDebug("Retrieving data in {{method}}...", "{name}");\nvar result = _random.Next(1, 1000);', 'result'),
+    ImplTemplate(('set', 'update'), '_logger.LogDebug("Setting data in {{method}}...", "{name}");\n_lastProcessTime = DateTime.Now;'),
+    ImplTemplate(('calculate', 'compute'), '_logger.LogDebug("Computing in {{method}}...", "{name}");\nvar computation = _bc * 1.5 + _processedCount;', 'computation', needs_lock=False),
+    ImplTemplate(('validate', 'check'), '_logger.LogDebug("Validating in {{method}}...", "{name}");\nvar isValid = _bc > 0 && _tout > 0;', 'isValid', needs_lock=False),
+)
+REALISTIC_IMPL_FALLBACK = ImplTemplate((), '_logger.LogDebug("Executing VB6 method {{method}}...", "{name}");\nvar result = _processedCount + _random.Next(1, 100);', 'result')
+REALISTIC_IMPL_TIMER_SUFFIX = '\n_logger.LogDebug("Timer-based processing for {{method}}", "{name}");'
+
+# Fields every generated Worker declares, keyed by field name so VB6 globals can't redeclare them
+STANDARD_WORKER_FIELDS = {
+    "_bc": "    private int _bc = 30000;",
+    "_bcLong": "    private long _bcLong = 30000;",
+    "_cmd": "    private byte _cmd = 0;",
+    "_req": "    private byte _req = 0;",
+    "_tout": "    private long _tout = 30000;",
+    "_mlngMetaDataTout": "    private long _mlngMetaDataTout = 60000;",
+    "_mbytMetaDataReq": "    private byte _mbytMetaDataReq = 0;",
+    "_mintMetaDataBC": "    private int _mintMetaDataBC = 0;",
+    "_msgData": "    private byte[] _msgData;",
+    "_maskData": "    private byte[] _maskData;"
+}
+
+@dataclass(slots=True)
+class NormalizedGlobal:
+    """A VB6 global resolved to its C# field name, type and declaration default."""
+    field_name: str
+    csharp_type: str
+    has_default: bool
+    csharp_default: str
+
+class GeneratorModule(dspy.Module):
+    def __init__(self):
+        super().__init__()
+        self.lm = shared_lm
+        self._identifier_rewriter_cache = None  # (context_map, identifiers, compiled pattern) of the last generation
+
+    def forward(self, yaml_summary: str, context_map: dict) -> dict:
+        logger.info("Starting code generation", extra={"stage": "generator"})
+        try:
+            summary_data = yaml.load(yaml_summary, Loader=YAML_LOADER)
+            procedures = summary_data.get('procedures', [])
+            globals_list = summary_data.get('globals', [])
+            main_logic = summary_data.get('main_logic', {})
+            metadata = summary_data.get('metadata', {})
+            
+            logger.info(f"Generating Worker.cs with {len(procedures)} procedures and {len(globals_list)} globals", extra={"stage": "generator"})
+            
+            result = self._build_complete_project(
+                self._generate_comprehensive_worker(procedures, globals_list, context_map, main_logic, metadata)
+            )
+            logger.info("Code generation completed", extra={"stage": "generator"})
+            return result
+        except Exception as e:
+            logger.error(f"Error parsing YAML summary: {e}", extra={"stage": "generator"})
+            return self._build_complete_project(self._get_enhanced_worker_template(yaml_summary, context_map))
+
+    def _generate_comprehensive_worker(self, procedures: List, globals_list: List, context_map: dict, main_logic: dict, metadata: dict) -> str:
+        logger.info("Generating comprehensive Worker.cs", extra={"stage": "generator"})
+        normalized_globals = self._normalize_globals(globals_list)
+        fields_code = self._generate_fields(normalized_globals)
+        methods_code = self._generate_methods(procedures, context_map)
+        execute_async_code = self._generate_execute_async(procedures, main_logic, context_map)
+        primary_module = main_logic.get('primary_module', 'ConvertedService')
+        namespace = f"{self._sanitize_namespace(primary_module)}Namespace"
+        
+        return WORKER_CS_TEMPLATE.substitute(
+            namespace=namespace,
+            fields_code=fields_code,
+            field_initializations=self._generate_field_initializations(normalized_globals),
+            procedure_count=len(procedures),
+            global_count=len(globals_list),
+            execute_async_code=execute_async_code,
+            methods_code=methods_code,
+            procedure_calls=self._generate_procedure_calls(procedures, context_map)
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=2048)
+    def _sanitize_namespace(name: str) -> str:
+        """Sanitize module name for use in C# namespace."""
+        sanitized = name.translate(NON_ALNUM_ASCII_TABLE) if name.isascii() else NON_ALNUM_RE.sub('', name)
+        return sanitized or "ConvertedService"
+
+    def _normalize_globals(self, globals_list: List) -> List[NormalizedGlobal]:
+        """Convert each distinct VB6 global to its C# field metadata once, for both fields and initializations."""
+        normalized = []
+        seen_fields = set()
+        for global_var in globals_list:
+            if isinstance(global_var, dict):
+                name = global_var.get('name', '')
+                module_name = global_var.get('module_name', '')
+                if name:
+                    qualified = f"{module_name}_{name}" if module_name else name
+                    field_name = f"_{qualified[:1].lower()}{qualified[1:]}"
+                    if field_name not in seen_fields:
+                        default_value = global_var.get('default_value', '')
+                        csharp_type = self._convert_vb6_type_to_csharp(global_var.get('type', 'object'))
+                        normalized.append(NormalizedGlobal(
+                            field_name=field_name,
+                            csharp_type=csharp_type,
+                            has_default=bool(default_value),
+                            csharp_default=self._convert_vb6_default_to_csharp(default_value, csharp_type)
+                        ))
+                        seen_fields.add(field_name)
+        return normalized
+
+    def _generate_fields(self, globals_list: List[NormalizedGlobal]) -> str:
+        logger.info("Generating fields from globals", extra={"stage": "generator"})
+        fields = dict(STANDARD_WORKER_FIELDS)
+        for global_var in globals_list:
+            if global_var.field_name not in fields:
+                fields[global_var.field_name] = f"    private {global_var.csharp_type} {global_var.field_name}{global_var.csharp_default};"
+        return '\n'.join(fields.values())
+
+    def _generate_field_initializations(self, globals_list: List[NormalizedGlobal]) -> str:
+        initializations = []
+        for global_var in globals_list:
+            csharp_value = global_var.csharp_default
+            if global_var.has_default and csharp_value and not csharp_value.startswith(' = '):
+                initializations.append(f"            {global_var.field_name} = {csharp_value};")
+        return '\n'.join(initializations) if initializations else "            // No additional initialization required"
+
+    def _generate_methods(self, procedures: List, context_map: dict) -> str:
+        methods = []
+        standard_methods = [
+            """    public void SetServeParameters(object newServeParameters)
+    {
+        _logger.LogInformation("VB6 SetServeParameters called with: {params}", newServeParameters);
+        lock (_lockObject)
+        {
+            if (newServeParameters != null)
+            {
+                _cmd = (byte)((_cmd + 1) % 256);
+                _req = (byte)((_req + 1) % 256);
+                _logger.LogDebug("Parameters updated - Command: {cmd}, Request: {req}", _cmd, _req);
+            }
+        }
+    }""",
+            """    public void ReinitializeValueCache()
+    {
+        _logger.LogInformation("VB6 ReinitializeValueCache called");
+        lock (_lockObject)
+        {
+            _bc = 30000;
+            _bcLong = 30000;
+            if (_msgData != null) Array.Clear(_msgData, 0, _msgData.Length);
+            if (_maskData != null) Array.Clear(_maskData, 0, _maskData.Length);
+            _logger.LogDebug("Value cache reinitialized");
+        }
+    }""",
+            """    public ReturnCode GetComputedResult(string parameterXYZName, ref ValueResult valResult, 
+        int recordNumber = 0, int precision = 0, SeriesDirections seriesDirection = SeriesDirections.Increasing, 
+        bool summation = false)
+    {
+        _logger.LogInformation("VB6 GetComputedResult called - Parameter: {param}, Record: {record}", 
+            parameterXYZName, recordNumber);
+        try
+        {
+            lock (_lockObject)
+            {
+                valResult = new ValueResult 
+                { 
+                    Value = _random.NextDouble() * 100 + recordNumber,
+                    IsValid = true,
                     ComputedAt = DateTime.Now,
                     ParameterName = parameterXYZName,
                     Precision = precision
@@ -807,13 +1702,16 @@ public enum SeriesDirections
         methods.extend(standard_methods)
         seen_methods = set(['SetServeParameters', 'ReinitializeValueCache', 'GetComputedResult'])
         for procedure in procedures:
-            if isinstance(procedure, dict):
-                method_code = self._generate_method_from_procedure(procedure, context_map)
-                if method_code:
-                    method_name = self._get_method_name(procedure)
-                    if method_name not in seen_methods:
-                        methods.append(method_code)
-                        seen_methods.add(method_name)
+            if not isinstance(procedure, dict):
+                continue
+            # Dedupe before generating, so a duplicate's body is never built just to be discarded
+            method_name = self._get_method_name(procedure)
+            if method_name in seen_methods:
+                continue
+            method_code = self._generate_method_from_procedure(procedure, context_map, method_name)
+            if method_code:
+                methods.append(method_code)
+                seen_methods.add(method_name)
         return '\n\n'.join(methods)
 
     def _get_method_name(self, procedure: dict) -> str:
@@ -821,9 +1719,7 @@ public enum SeriesDirections
         module_name = procedure.get('module_name', '')
         return f"{module_name}_{name}" if module_name else name
 
-    def _generate_method_from_procedure(self, procedure: dict, context_map: dict) -> str:
-        name = procedure.get('name', 'UnknownProcedure')
-        module_name = procedure.get('module_name', '')
+    def _generate_method_from_procedure(self, procedure: dict, context_map: dict, method_name: Optional[str] = None) -> str:
         parameters = procedure.get('parameters', [])
         return_type = procedure.get('return_type', 'void')
         body = procedure.get('body', '')
@@ -832,7 +1728,7 @@ public enum SeriesDirections
         csharp_return_type = self._convert_vb6_type_to_csharp(return_type)
         csharp_params = self._convert_vb6_parameters_to_csharp(parameters)
         csharp_access = 'public' if access_level.lower() == 'public' else 'private'
-        method_name = f"{module_name}_{name}" if module_name else name
+        method_name = method_name or self._get_method_name(procedure)
         method_body = self._generate_method_body(method_name, body, csharp_return_type, is_function, context_map)
         return f"""    {csharp_access} {csharp_return_type} {method_name}({csharp_params})
     {{
@@ -849,45 +1745,32 @@ public enum SeriesDirections
     }}"""
 
     def _generate_method_body(self, name: str, vb6_body: str, return_type: str, is_function: bool, context_map: dict) -> str:
-        lines = []
-        lines.append("            lock (_lockObject)")
-        lines.append("            {")
         if vb6_body and len(vb6_body.strip()) > 0:
-            converted_body = self._convert_vb6_body_to_csharp(vb6_body, name, return_type, context_map)
-            lines.extend([f"                {line}" for line in converted_body.split('\n') if line.strip()])
+            body = self._convert_vb6_body_to_csharp(vb6_body, name, return_type, context_map)
+            # Converted VB6 can call anything; only bodies with no assignment or increment outside strings skip the lock
+            needs_lock = bool(CSHARP_MUTATION_RE.search(CSHARP_STRING_LITERAL_RE.sub('""', body)))
         else:
-            realistic_impl = self._generate_realistic_implementation(name, return_type, is_function, context_map)
-            lines.extend([f"                {line}" for line in realistic_impl.split('\n') if line.strip()])
+            body, needs_lock = self._generate_realistic_implementation(name, return_type, is_function, context_map)
+        if not needs_lock:
+            return '\n'.join(f"            {line}" for line in body.split('\n') if line.strip())
+        lines = ["            lock (_lockObject)", "            {"]
+        lines.extend(f"                {line}" for line in body.split('\n') if line.strip())
         lines.append("            }")
         return '\n'.join(lines)
 
-    def _convert_vb6_body_to_csharp(self, vb6_body: str, method_name: str, return_type: str, context_map: dict) -> str:
-        csharp_body = vb6_body
-        replacements = {
-            'Dim ': 'var ',
-            ' As Integer': '',
-            ' As String': '',
-            ' As Boolean': '',
-            ' As Long': '',
-            ' As Byte': '',
-            'Set ': '',
-            'Nothing': 'null',
-            'True': 'true',
-            'False': 'false',
-            'And': '&&',
-            'Or': '||',
-            'Not ': '!',
-            '<>': '!=',
-            '&': '+',
-        }
-        for vb6_pattern, csharp_pattern in replacements.items():
-            csharp_body = csharp_body.replace(vb6_pattern, csharp_pattern)
+    def _identifier_rewriter(self, context_map: dict) -> Tuple[Dict[str, str], Optional[re.Pattern]]:
+        """Map global variable and callee names to their C# identifiers, compiled once per context map rather than per method body."""
+        cached = self._identifier_rewriter_cache
+        if cached is not None and cached[0] is context_map:
+            return cached[1], cached[2]
+        identifiers = {}
         for global_var in context_map.get('state_management', {}).get('global_variables', []):
             var_parts = global_var.split(':')
             var_name = var_parts[0]
             module_name = var_parts[1] if len(var_parts) > 1 else ''
-            csharp_var = f"_{self._to_camel_case(f'{module_name}_{var_name}' if module_name else var_name)}"
-            csharp_body = csharp_body.replace(var_name, csharp_var)
+            if var_name:
+                qualified = f"{module_name}_{var_name}" if module_name else var_name
+                identifiers.setdefault(var_name, f"_{qualified[:1].lower()}{qualified[1:]}")
         for call in context_map.get('module_hierarchy', {}).get('call_graph', []):
             caller = call.get('caller', '')
             callee = call.get('callee', '')
@@ -895,49 +1778,46 @@ public enum SeriesDirections
                 callee_parts = callee.split('.')
                 if len(callee_parts) == 2:
                     callee_module, callee_proc = callee_parts
-                    csharp_callee = f"{callee_module}_{callee_proc}"
-                    csharp_body = csharp_body.replace(callee_proc, csharp_callee)
-        if return_type != 'void' and not 'return' in csharp_body.lower():
-            if return_type == 'bool':
-                csharp_body += '\nreturn true;'
-            elif return_type in ['int', 'long', 'byte']:
-                csharp_body += f'\nreturn 0;'
-            elif return_type == 'string':
-                csharp_body += '\nreturn string.Empty;'
-            else:
-                csharp_body += f'\nreturn default({return_type});'
-        return csharp_body
+                    if callee_proc:
+                        identifiers.setdefault(callee_proc, f"{callee_module}_{callee_proc}")
+        identifier_re = compile_token_alternation(identifiers) if identifiers else None
+        self._identifier_rewriter_cache = (context_map, identifiers, identifier_re)
+        return identifiers, identifier_re
 
-    def _generate_realistic_implementation(self, method_name: str, return_type: str, is_function: bool, context_map: dict) -> str:
-        name_lower = method_name.lower()
-        main_workflow = context_map.get('main_workflow', {})
-        processing_pattern = main_workflow.get('processing_pattern', 'Sequential')
-        if 'initialize' in name_lower or 'init' in name_lower:
-            return f"""_logger.LogDebug("Initializing {{method}}...", "{method_name}");
-_cmd = 0;
-_req = 0;""" + (f'\nreturn {self._get_default_return(return_type)};' if return_type != 'void' else '')
-        elif 'process' in name_lower or 'execute' in name_lower:
-            impl = f"""_logger.LogDebug("Processing in {{method}}...", "{method_name}");
-await Task.Delay(50);
-_processedCount++;"""
-            if processing_pattern == 'Timer':
-                impl += f"\n_logger.LogDebug(\"Timer-based processing for {{method}}\", \"{method_name}\");"
-            return impl + (f'\nreturn {self._get_default_return(return_type)};' if return_type != 'void' else '')
-        elif 'get' in name_lower or 'retrieve' in name_lower:
-            return f"""_logger.LogDebug("Retrieving data in {{method}}...", "{method_name}");
-var result = _random.Next(1, 1000);""" + (f'\nreturn {self._get_typed_return(return_type, "result")};' if return_type != 'void' else '')
-        elif 'set' in name_lower or 'update' in name_lower:
-            return f"""_logger.LogDebug("Setting data in {{method}}...", "{method_name}");
-_lastProcessTime = DateTime.Now;""" + (f'\nreturn {self._get_default_return(return_type)};' if return_type != 'void' else '')
-        elif 'calculate' in name_lower or 'compute' in name_lower:
-            return f"""_logger.LogDebug("Computing in {{method}}...", "{method_name}");
-var computation = _bc * 1.5 + _processedCount;""" + (f'\nreturn {self._get_typed_return(return_type, "computation")};' if return_type != 'void' else '')
-        elif 'validate' in name_lower or 'check' in name_lower:
-            return f"""_logger.LogDebug("Validating in {{method}}...", "{method_name}");
-var isValid = _bc > 0 && _tout > 0;""" + (f'\nreturn {self._get_typed_return(return_type, "isValid")};' if return_type != 'void' else '')
+    def _convert_vb6_body_to_csharp(self, vb6_body: str, method_name: str, return_type: str, context_map: dict) -> str:
+        csharp_body = VB6_KEYWORD_RE.sub(lambda m: VB6_KEYWORD_REPLACEMENTS[m.group(0)], vb6_body)
+        identifiers, identifier_re = self._identifier_rewriter(context_map)
+        if identifiers:
+            # One pass over the body; whole identifiers only, and replaced text is never rescanned
+            csharp_body = identifier_re.sub(lambda m: identifiers[m.group(0)], csharp_body)
+        if return_type == 'void' or 'return' in csharp_body.lower():
+            return csharp_body
+        if return_type == 'bool':
+            return_line = 'return true;'
+        elif return_type in ['int', 'long', 'byte']:
+            return_line = 'return 0;'
+        elif return_type == 'string':
+            return_line = 'return string.Empty;'
         else:
-            return f"""_logger.LogDebug("Executing VB6 method {{method}}...", "{method_name}");
-var result = _processedCount + _random.Next(1, 100);""" + (f'\nreturn {self._get_typed_return(return_type, "result")};' if return_type != 'void' else '')
+            return_line = f'return default({return_type});'
+        return '\n'.join((csharp_body, return_line))
+
+    def _generate_realistic_implementation(self, method_name: str, return_type: str, is_function: bool, context_map: dict) -> Tuple[str, bool]:
+        """Return the placeholder body and whether it must run under _lockObject."""
+        name_lower = method_name.lower()
+        template = next(
+            (t for t in REALISTIC_IMPL_TEMPLATES if any(keyword in name_lower for keyword in t.keywords)),
+            REALISTIC_IMPL_FALLBACK
+        )
+        impl = template.body.format(name=method_name)
+        if template.timer_aware and context_map.get('main_workflow', {}).get('processing_pattern', 'Sequential') == 'Timer':
+            impl += REALISTIC_IMPL_TIMER_SUFFIX.format(name=method_name)
+        if return_type != 'void':
+            if template.result_var is None:
+                impl = f"{impl}\nreturn {self._get_default_return(return_type)};"
+            else:
+                impl = f"{impl}\nreturn {self._get_typed_return(return_type, template.result_var)};"
+        return impl, template.needs_lock
 
     def _generate_execute_async(self, procedures: List, main_logic: dict, context_map: dict) -> str:
         processing_pattern = main_logic.get('processing_pattern', 'Sequential')
@@ -954,467 +1834,174 @@ var result = _processedCount + _random.Next(1, 100);""" + (f'\nreturn {self._get
         _logger.LogInformation("VB6 Converted Worker Service started at: {{time}}", DateTimeOffset.Now);
         try
         {{
-            while (!stoppingToken.IsCancellationRequested)
-            {{
-                await ProcessMainWorkflow(stoppingToken);
-                var delay = Math.Max({delay_ms}, (int)(_tout / 30));
-                await Task.Delay(delay, stoppingToken);
-            }}
-        }}
-        catch (OperationCanceledException)
-        {{
-            _logger.LogInformation("Worker service cancellation requested");
-        }}
-        catch (Exception ex)
-        {{
-            _logger.LogError(ex, "Fatal error in worker service");
-            throw;
-        }}
-        finally
-        {{
-            await PerformCleanup();
-            _logger.LogInformation("VB6 Converted Worker Service stopped at: {{time}}", DateTimeOffset.Now);
-        }}
-    }}"""
-
-    def _generate_procedure_calls(self, procedures: List, context_map: dict) -> str:
-        calls = []
-        module_hierarchy = context_map.get('module_hierarchy', {})
-        main_module = module_hierarchy.get('main_module', '')
-        call_graph = module_hierarchy.get('call_graph', [])
-        # Group procedures by module
-        module_procs = {}
-        for proc in procedures:
-            module_name = proc.get('module_name', '')
-            if module_name not in module_procs:
-                module_procs[module_name] = []
-            module_procs[module_name].append(proc)
-        # Prioritize main module and dependencies
-        ordered_modules = [main_module] + [m for m in module_procs.keys() if m and m != main_module]
-        for module_name in ordered_modules:
-            if module_name in module_procs:
-                for i, procedure in enumerate(module_procs[module_name]):
-                    name = procedure.get('name', '')
-                    return_type = procedure.get('return_type', 'void')
-                    method_name = f"{module_name}_{name}" if module_name else name
-                    if name:
-                        calls.append(f"            // Call VB6 procedure {i+1} from {module_name or 'unknown module'}")
-                        if return_type == 'void':
-                            calls.append(f"            {method_name}();")
-                        else:
-                            calls.append(f"            var result{i+1} = {method_name}();")
-                            calls.append(f"            _logger.LogDebug(\"VB6 function {method_name} returned: {{result}}\", result{i+1});")
-                        calls.append("")
-        if not calls:
-            calls.append("            // No VB6 procedures to execute")
-            calls.append("            _logger.LogDebug(\"No extracted VB6 procedures found\");")
-        return '\n'.join(calls)
-
-    def _convert_vb6_type_to_csharp(self, vb6_type: str) -> str:
-        type_map = {
-            'Integer': 'int',
-            'String': 'string',
-            'Boolean': 'bool',
-            'Long': 'long',
-            'Byte': 'byte',
-            'Single': 'float',
-            'Double': 'double',
-            'Currency': 'decimal',
-            'Date': 'DateTime',
-            'Object': 'object',
-            'Variant': 'object',
-            'void': 'void'
-        }
-        return type_map.get(vb6_type, 'object')
-
-    def _convert_vb6_parameters_to_csharp(self, parameters: List) -> str:
-        if not parameters:
-            return ""
-        csharp_params = []
-        for param in parameters:
-            if ':' in str(param):
-                param_parts = str(param).split(':')
-                param_name = param_parts[0].strip()
-                param_type = param_parts[1].strip() if len(param_parts) > 1 else 'object'
-                csharp_type = self._convert_vb6_type_to_csharp(param_type)
-                csharp_params.append(f"{csharp_type} {param_name}")
-            else:
-                csharp_params.append(f"object {param}")
-        return ', '.join(csharp_params)
-
-    def _convert_vb6_default_to_csharp(self, default_value: str, csharp_type: str) -> str:
-        if not default_value:
-            return ""
-        if default_value.lower() in ['nothing', 'null']:
-            return " = null"
-        elif default_value.lower() == 'true':
-            return " = true"
-        elif default_value.lower() == 'false':
-            return " = false"
-        elif default_value.startswith('"') and default_value.endswith('"'):
-            return f" = {default_value}"
-        elif default_value.isdigit():
-            return f" = {default_value}"
-        else:
-            type_defaults = {
-                'int': ' = 0',
-                'long': ' = 0L',
-                'byte': ' = 0',
-                'bool': ' = false',
-                'string': ' = string.Empty',
-                'object': ' = null'
-            }
-            return type_defaults.get(csharp_type, "")
-
-    def _to_camel_case(self, name: str) -> str:
-        if not name:
-            return name
-        return name[0].lower() + name[1:] if len(name) > 1 else name.lower()
-
-    def _get_default_return(self, return_type: str) -> str:
-        defaults = {
-            'int': '0',
-            'long': '0L',
-            'byte': '0',
-            'bool': 'true',
-            'string': 'string.Empty',
-            'float': '0.0f',
-            'double': '0.0',
-            'decimal': '0m'
-        }
-        return defaults.get(return_type, 'null')
-
-    def _get_typed_return(self, return_type: str, variable_name: str) -> str:
-        if return_type == 'int':
-            return f"(int){variable_name}"
-        elif return_type == 'long':
-            return f"(long){variable_name}"
-        elif return_type == 'byte':
-            return f"(byte){variable_name}"
-        elif return_type == 'bool':
-            return f"({variable_name} != null && {variable_name}.ToString() != \"0\")"
-        elif return_type == 'string':
-            return f"{variable_name}?.ToString() ?? string.Empty"
-        else:
-            return f"({return_type}){variable_name}"
-
-    def _generate_error_return(self, return_type: str) -> str:
-        if return_type == 'void':
-            return ""
-        elif return_type == 'bool':
-            return "return false;"
-        elif return_type in ['int', 'long', 'byte']:
-            return "return -1;"
-        elif return_type == 'string':
-            return "return string.Empty;"
-        else:
-            return f"return default({return_type});"
-
-    def _get_enhanced_worker_template(self, yaml_summary: str, context_map: dict) -> str:
-        main_module = context_map.get('module_hierarchy', {}).get('main_module', 'ConvertedService')
-        namespace = f"{self._sanitize_namespace(main_module)}Namespace"
-        return f"""using Microsoft.Extensions.Hosting;
-using Microsoft.Extensions.Logging;
-using System;
-using System.Threading;
-using System.Threading.Tasks;
-
-namespace {namespace};
-
-public class Worker : BackgroundService
-{{
-    private readonly ILogger<Worker> _logger;
-    private int _bc = 30000;
-    private long _bcLong = 30000;
-    private byte _cmd = 0;
-    private byte _req = 0;
-    private long _tout = 30000;
-    private long _mlngMetaDataTout = 60000;
-    private byte _mbytMetaDataReq = 0;
-    private int _mintMetaDataBC = 0;
-    private readonly object _lockObject = new object();
-
-    public Worker(ILogger<Worker> logger)
-    {{
-        _logger = logger;
-        ClassInitialize();
-    }}
-
-    private void ClassInitialize()
-    {{
-        lock (_lockObject)
-        {{
-            _cmd = 0;
-            _req = 0;
-            _tout = 30000;
-            _bc = 30000;
-            _logger.LogInformation("VB6 Worker Service initialized");
-        }}
-    }}
-
-    protected override async Task ExecuteAsync(CancellationToken stoppingToken)
-    {{
-        _logger.LogInformation("VB6 Converted Worker Service started at: {{time}}", DateTimeOffset.Now);
-        
-        while (!stoppingToken.IsCancellationRequested)
-        {{
-            try
-            {{
-                await ProcessVB6Logic(stoppingToken);
-                await Task.Delay(1000, stoppingToken);
-            }}
-            catch (OperationCanceledException)
-            {{
-                _logger.LogInformation("Operation was canceled");
-                break;
-            }}
-            catch (Exception ex)
-            {{
-                _logger.LogError(ex, "Error in VB6 processing");
-                await Task.Delay(5000, stoppingToken);
-            }}
-        }}
-        
-        _logger.LogInformation("VB6 Converted Worker Service stopped at: {{time}}", DateTimeOffset.Now);
-    }}
-
-    private async Task ProcessVB6Logic(CancellationToken stoppingToken)
-    {{
-        _logger.LogInformation("Processing VB6 logic - ByteCount: {{bc}}, Command: {{cmd}}", _bc, _cmd);
-        
-        lock (_lockObject)
-        {{
-            _cmd = (byte)((_cmd + 1) % 256);
-            _req = (byte)((_req + 1) % 256);
-        }}
-        
-        await Task.Delay(100, stoppingToken);
-    }}
-
-    public int ByteCount() => _bc;
-    public long ByteCountLong() => _bcLong;
-    public byte Command() => _cmd;
-    public byte Request() => _req;
-    public long Timeout() => _tout;
-    public long LngMetaDataRequestTimeOut() => _mlngMetaDataTout;
-    public byte BytMetaDataRequest() => _mbytMetaDataReq;
-    public int IntMetaDataByteCount() => _mintMetaDataBC;
-
-    public void SetServeParameters(object newServeParameters)
-    {{
-        _logger.LogInformation("VB6 SetServeParameters called");
-        lock (_lockObject)
-        {{
-            if (newServeParameters != null)
-            {{
-                _cmd = (byte)((_cmd + 1) % 256);
-            }}
-        }}
-    }}
-
-    public void ReinitializeValueCache()
-    {{
-        _logger.LogInformation("VB6 ReinitializeValueCache called");
-        lock (_lockObject)
-        {{
-            _bc = 30000;
-            _bcLong = 30000;
-        }}
-    }}
-
-    public ReturnCode GetComputedResult(string parameterXYZName, ref ValueResult valResult, 
-        int recordNumber = 0, int precision = 0, SeriesDirections seriesDirection = SeriesDirections.Increasing, 
-        bool summation = false)
-    {{
-        _logger.LogInformation("VB6 GetComputedResult called for parameter: {{param}}", parameterXYZName);
-        
-        try
+            while (!stoppingToken.IsCancellationRequested)
+            {{
+                await ProcessMainWorkflow(stoppingToken);
+                var delay = Math.Max({delay_ms}, (int)(_tout / 30));
+                await Task.Delay(delay, stoppingToken);
+            }}
+        }}
+        catch (OperationCanceledException)
         {{
-            valResult = new ValueResult 
-            {{ 
-                Value = new Random().NextDouble() * 100,
-                IsValid = true,
-                ParameterName = parameterXYZName
-            }};
-            
-            return ReturnCode.Success;
+            _logger.LogInformation("Worker service cancellation requested");
         }}
         catch (Exception ex)
         {{
-            _logger.LogError(ex, "Error in GetComputedResult");
-            valResult = new ValueResult {{ IsValid = false }};
-            return ReturnCode.Failure;
+            _logger.LogError(ex, "Fatal error in worker service");
+            throw;
         }}
-    }}
-}}
+        finally
+        {{
+            await PerformCleanup();
+            _logger.LogInformation("VB6 Converted Worker Service stopped at: {{time}}", DateTimeOffset.Now);
+        }}
+    }}"""
 
-public class ValueResult
-{{
-    public double Value {{ get; set; }}
-    public bool IsValid {{ get; set; }}
-    public string ParameterName {{ get; set; }} = string.Empty;
-}}
+    def _generate_procedure_calls(self, procedures: List, context_map: dict) -> str:
+        calls = []
+        module_hierarchy = context_map.get('module_hierarchy', {})
+        main_module = module_hierarchy.get('main_module', '')
+        call_graph = module_hierarchy.get('call_graph', [])
+        # Group procedures by module
+        module_procs = defaultdict(list)
+        for proc in procedures:
+            module_procs[proc.get('module_name', '')].append(proc)
+        # Prioritize main module and dependencies
+        ordered_modules = [main_module] + [m for m in module_procs if m and m != main_module]
+        for module_name in ordered_modules:
+            procs = module_procs.get(module_name)
+            if procs:
+                method_prefix = f"{module_name}_" if module_name else ""
+                for i, procedure in enumerate(procs):
+                    name = procedure.get('name', '')
+                    return_type = procedure.get('return_type', 'void')
+                    method_name = method_prefix + name
+                    if name:
+                        calls.append(f"            // Call VB6 procedure {i+1} from {module_name or 'unknown module'}")
+                        if return_type == 'void':
+                            calls.append(f"            {method_name}();")
+                        else:
+                            calls.append(f"            var result{i+1} = {method_name}();")
+                            calls.append(f"            _logger.LogDebug(\"VB6 function {method_name} returned: {{result}}\", result{i+1});")
+                        calls.append("")
+        if calls:
+            calls.pop()  # no blank line after the last call
+        else:
+            calls.append("            // No VB6 procedures to execute")
+            calls.append("            _logger.LogDebug(\"No extracted VB6 procedures found\");")
+        return '\n'.join(calls)
 
-public enum ReturnCode
-{{
-    Success,
-    Failure
-}}
+    def _convert_vb6_type_to_csharp(self, vb6_type: str) -> str:
+        return VB6_TO_CSHARP_TYPES.get(vb6_type, 'object')
 
-public enum SeriesDirections
-{{
-    Increasing,
-    Decreasing
-}}
-"""
+    def _convert_vb6_parameters_to_csharp(self, parameters: List) -> str:
+        if not parameters:
+            return ""
+        csharp_params = []
+        for param in parameters:
+            if ':' in str(param):
+                param_parts = str(param).split(':')
+                param_name = param_parts[0].strip()
+                param_type = param_parts[1].strip() if len(param_parts) > 1 else 'object'
+                csharp_type = self._convert_vb6_type_to_csharp(param_type)
+                csharp_params.append(f"{csharp_type} {param_name}")
+            else:
+                csharp_params.append(f"object {param}")
+        return ', '.join(csharp_params)
+
+    def _convert_vb6_default_to_csharp(self, default_value: str, csharp_type: str) -> str:
+        if not default_value:
+            return ""
+        if default_value.lower() in ['nothing', 'null']:
+            return " = null"
+        elif default_value.lower() == 'true':
+            return " = true"
+        elif default_value.lower() == 'false':
+            return " = false"
+        elif default_value.startswith('"') and default_value.endswith('"'):
+            return f" = {default_value}"
+        elif default_value.isdigit():
+            return f" = {default_value}"
+        else:
+            type_defaults = {
+                'int': ' = 0',
+                'long': ' = 0L',
+                'byte': ' = 0',
+                'bool': ' = false',
+                'string': ' = string.Empty',
+                'object': ' = null'
+            }
+            return type_defaults.get(csharp_type, "")
+
+    def _get_default_return(self, return_type: str) -> str:
+        return CSHARP_DEFAULT_RETURNS.get(return_type, 'null')
+
+    def _get_typed_return(self, return_type: str, variable_name: str) -> str:
+        template = CSHARP_TYPED_RETURNS.get(return_type)
+        if template is None:
+            return f"({return_type}){variable_name}"
+        return template.format(v=variable_name)
+
+    def _generate_error_return(self, return_type: str) -> str:
+        if return_type == 'void':
+            return ""
+        elif return_type == 'bool':
+            return "return false;"
+        elif return_type in ['int', 'long', 'byte']:
+            return "return -1;"
+        elif return_type == 'string':
+            return "return string.Empty;"
+        else:
+            return f"return default({return_type});"
+
+    def _get_enhanced_worker_template(self, yaml_summary: str, context_map: dict) -> str:
+        main_module = context_map.get('module_hierarchy', {}).get('main_module', 'ConvertedService')
+        namespace = f"{self._sanitize_namespace(main_module)}Namespace"
+        return FALLBACK_WORKER_CS_TEMPLATE.substitute(namespace=namespace)
 
     def _build_complete_project(self, worker_cs: str) -> dict:
         logger.info("Building complete project files", extra={"stage": "generator"})
         safe = {
-            "MyWindowsService_csproj": self._get_csproj(),
-            "Program_cs": self._get_program_cs(),
+            "MyWindowsService_csproj": CSPROJ_CONTENT,
+            "Program_cs": PROGRAM_CS_CONTENT,
             "Worker_cs": worker_cs,
-            "appsettings_json": self._get_appsettings(),
-            "appsettings_Development_json": self._get_dev_appsettings(),
-            "Properties__launchSettings_json": self._get_launch_settings(),
+            "appsettings_json": APPSETTINGS_JSON_CONTENT,
+            "appsettings_Development_json": APPSETTINGS_DEVELOPMENT_JSON_CONTENT,
+            "Properties__launchSettings_json": LAUNCH_SETTINGS_JSON_CONTENT,
         }
         try:
-            validated = CodeFilesModel(**safe)
-            return {
-                "MyWindowsService.csproj": validated.MyWindowsService_csproj,
-                "Program.cs": validated.Program_cs,
-                "Worker.cs": validated.Worker_cs,
-                "appsettings.json": validated.appsettings_json,
-                "appsettings.Development.json": validated.appsettings_Development_json,
-                "Properties/launchSettings.json": validated.Properties__launchSettings_json,
-            }
+            # Validation only; the strings are already final, so the output is keyed straight from them
+            CodeFilesModel(**safe)
+            return {PROJECT_FILE_NAMES[key]: content for key, content in safe.items()}
         except Exception as e:
             logger.error(f"Project validation error: {e}", extra={"stage": "generator"})
             raise HTTPException(status_code=500, detail="Generated project validation failed")
 
-    def _get_csproj(self) -> str:
-        return """<Project Sdk="Microsoft.NET.Sdk.Worker">
-  <PropertyGroup>
-    <TargetFramework>net9.0</TargetFramework>
-    <Nullable>enable</Nullable>
-    <ImplicitUsings>enable</ImplicitUsings>
-    <UserSecretsId>dotnet-MyWindowsService-$(MSBuildProjectName)</UserSecretsId>
-    <UseAppHost>true</UseAppHost>
-    <PublishSingleFile>true</PublishSingleFile>
-    <SelfContained>true</SelfContained>
-  </PropertyGroup>
-  <ItemGroup>
-    <PackageReference Include="Microsoft.Extensions.Hosting" Version="9.0.0" />
-    <PackageReference Include="Microsoft.Extensions.Hosting.WindowsServices" Version="9.0.0" />
-    <PackageReference Include="Microsoft.Extensions.Logging.Console" Version="9.0.0" />
-    <PackageReference Include="Microsoft.Extensions.Logging.EventLog" Version="9.0.0" />
-  </ItemGroup>
-</Project>"""
-
-    def _get_program_cs(self) -> str:
-        return """using MyWindowsService;
-using Microsoft.Extensions.Logging.Configuration;
-using Microsoft.Extensions.Logging.EventLog;
-
-var builder = Host.CreateApplicationBuilder(args);
-
-// Configure logging
-builder.Logging.ClearProviders();
-builder.Logging.AddConsole();
-
-// Add Windows Event Log if running on Windows
-if (OperatingSystem.IsWindows())
-{
-    builder.Logging.AddEventLog();
-}
-
-// Add the worker service
-builder.Services.AddHostedService<Worker>();
-
-// Configure Windows Service
-builder.Services.AddWindowsService(options =>
-{
-    options.ServiceName = "VB6 Converted Service";
-});
-
-var host = builder.Build();
-
-try
-{
-    await host.RunAsync();
-}
-catch (Exception ex)
-{
-    var logger = host.Services.GetRequiredService<ILogger<Program>>();
-    logger.LogCritical(ex, "Application terminated unexpectedly");
-    throw;
-}"""
-
-    def _get_appsettings(self) -> str:
-        return """{
-  "Logging": {
-    "LogLevel": {
-      "Default": "Information",
-      "Microsoft.Hosting.Lifetime": "Information",
-      "MyWindowsService": "Information"
-    },
-    "Console": {
-      "IncludeScopes": true,
-      "TimestampFormat": "yyyy-MM-dd HH:mm:ss "
-    },
-    "EventLog": {
-      "LogLevel": {
-        "Default": "Warning"
-      }
-    }
-  },
-  "WorkerSettings": {
-    "ProcessingIntervalMs": 1000,
-    "TimeoutMs": 30000,
-    "MaxRetries": 50
-  }
-}"""
+# The DSPy modules keep no per-conversion state, so every MCP pipeline shares one of each
+parser_module = ParserModule()
+context_analyzer_module = ContextAnalyzerModule()
+generator_module = GeneratorModule()
 
-    def _get_dev_appsettings(self) -> str:
-        return """{
-  "logging": {
-    "logLevel": {
-      "default": "Debug",
-      "Microsoft.Hosting.Lifetime": "Information",
-      "MyWindowsService": "Debug"
-    }
-  }
-}"""
+def generate_in_process(yaml_summary: str, context_map: dict) -> dict:
+    # GeneratorModule holds the shared LM client, which can't be pickled; a pool process uses the one its import built
+    return generator_module.forward(yaml_summary, context_map)
 
-    def _get_launch_settings(self) -> str:
-        return """{
-  "profiles": {
-    "MyWindowsService": {
-      "commandName": "Project",
-      "dotnetRunMessages": true,
-      "environmentVariables": {
-        "DOTNET_ENVIRONMENT": "Development"
-      }
-    },
-    "MyWindowsService (Production)": {
-      "commandName": "Project",
-      "dotnetRunMessages": false,
-      "environmentVariables": {
-        "DOTNET_ENVIRONMENT": "Production"
-      }
-    }
-  }
-}"""
+# Spawned rather than forked: the parent has a running event loop and thread pools that a fork would copy mid-state
+generator_pool = ProcessPoolExecutor(max_workers=GENERATOR_PROCESSES, mp_context=multiprocessing.get_context("spawn")) if GENERATOR_PROCESSES > 0 else None
 
 # Base Agent Class
 class BaseAgent:
     def __init__(self, name: str):
         self.name = name
         self.state = AgentState.IDLE
+        self._last_logged = None
 
     async def set_state(self, state: AgentState, message: str = ""):
-        """Set the agent's state and emit it to the SSE queue."""
+        """Set the agent's state and emit it to the SSE queue, unless it repeats the last update verbatim."""
         self.state = state
+        if (state, message) == self._last_logged:
+            return
+        self._last_logged = (state, message)
         logger.info(
             message or f"{self.name} state changed to {state.value}",
             extra={
@@ -1430,47 +2017,72 @@ class IngestorAgent(BaseAgent):
     def __init__(self):
         super().__init__("IngestorAgent")
 
-    async def run(self, zip_file: Optional[UploadFile], github_link: Optional[str], temp_dir: str, conversion_id: str = None) -> List[dict]:
+    async def run(self, zip_source: Optional[Union[str, BinaryIO]], github_link: Optional[str], temp_dir: str, conversion_id: str = None, queue: Optional[asyncio.Queue] = None) -> List[dict]:
+        """Ingest the sources and return every VB6 file found.
+
+        With a queue, the first MAX_FILES files are also put on it as (index, file_info) the moment
+        they are found, followed by a None sentinel, so parsing can start while ingestion continues.
+        """
         await self.set_state(AgentState.RUNNING, "Starting ingestion process")
+        loop = asyncio.get_running_loop()
+        vb6_files = []
+
+        def publish(path: str):
+            file_info = {"path": path, "name": os.path.basename(path)}
+            vb6_files.append(file_info)
+            if queue is not None and len(vb6_files) <= MAX_FILES:
+                queue.put_nowait((len(vb6_files) - 1, file_info))
+
         try:
-            if zip_file:
-                if zip_file.size and zip_file.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            if zip_source:
+                if isinstance(zip_source, str):
+                    zip_size = os.path.getsize(zip_source)
+                else:
+                    zip_source.seek(0, os.SEEK_END)
+                    zip_size = zip_source.tell()
+                    zip_source.seek(0)
+                if zip_size > MAX_FILE_SIZE_MB * 1024 * 1024:
                     await self.set_state(AgentState.FAILED, f"File too large. Maximum size: {MAX_FILE_SIZE_MB}MB")
-                    raise HTTPException(f"File too large. Maximum size: {MAX_FILE_SIZE_MB}MB")
-                zip_path = os.path.join(temp_dir, "upload.zip")
-                await self.set_state(AgentState.RUNNING, "Saving uploaded ZIP file")
-                with open(zip_path, "wb") as f:
-                    while chunk := await zip_file.read(1024 * 1024):
-                        f.write(chunk)
+                    raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {MAX_FILE_SIZE_MB}MB")
                 try:
-                    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        for name in zip_ref.namelist():
-                            if not os.path.abspath(os.path.join(temp_dir, name)).startswith(os.path.abspath(temp_dir)):
-                                await self.set_state(AgentState.FAILED, "Path traversal detected in ZIP file")
-                                raise HTTPException(status_code=400, detail="Path traversal detected in ZIP file")
-                        zip_ref.extractall(temp_dir)
+                    # zlib releases the GIL while inflating, so a worker thread keeps the loop free
+                    # Extraction runs in a worker thread; each source is handed back to the loop as it lands
+                    await asyncio.to_thread(extract_zip_safely, zip_source, temp_dir, lambda path: loop.call_soon_threadsafe(publish, path))
                     await self.set_state(AgentState.RUNNING, "Successfully extracted ZIP file")
+                except ValueError as e:
+                    await self.set_state(AgentState.FAILED, str(e))
+                    raise HTTPException(status_code=400, detail=str(e))
                 except zipfile.BadZipFile:
                     await self.set_state(AgentState.FAILED, "Invalid or corrupted ZIP file")
                     raise HTTPException(status_code=400, detail="Invalid or corrupted ZIP file")
             elif github_link:
-                if not any(domain in github_link for domain in ALLOWED_GITHUB_DOMAINS):
+                if urlparse(github_link).hostname not in ALLOWED_GITHUB_DOMAINS:
                     await self.set_state(AgentState.FAILED, "GitHub domain not allowed")
                     raise HTTPException(status_code=400, detail="GitHub domain not allowed")
-                github_link = re.sub(r'[^a-zA-Z0-9:/.-]', '', github_link)
-                await self.set_state(AgentState.RUNNING, f"Cloning GitHub repository: {github_link}")
-                try:
-                    Repo.clone_from(github_link, temp_dir, depth=1)
-                    await self.set_state(AgentState.RUNNING, f"Successfully cloned repository: {github_link}")
-                except Exception as e:
-                    await self.set_state(AgentState.FAILED, f"Failed to clone GitHub repo: {str(e)}")
-                    raise HTTPException(status_code=400, detail=f"Failed to clone GitHub repo: {str(e)}")
-            vb6_files = []
-            for root, _, files in os.walk(temp_dir):
-                for fname in files:
-                    if fname.lower().endswith(('.frm', '.bas', '.cls', '.vbp')):
-                        file_path = os.path.join(root, fname)
-                        vb6_files.append({"path": file_path, "name": fname})
+                github_link = GITHUB_LINK_UNSAFE_RE.sub('', github_link)
+                await self.set_state(AgentState.RUNNING, f"Downloading GitHub repository archive: {github_link}")
+                archive_path = os.path.join(temp_dir, "_github_archive.zip")
+                downloaded = await download_github_archive(github_link, archive_path)
+                if downloaded:
+                    try:
+                        await asyncio.to_thread(extract_zip_safely, archive_path, temp_dir)
+                        await self.set_state(AgentState.RUNNING, f"Successfully downloaded repository: {github_link}")
+                    except (ValueError, zipfile.BadZipFile) as e:
+                        logger.warning(f"Unusable GitHub archive, falling back to git clone: {e}", extra={"stage": "ingestor"})
+                        downloaded = False
+                    finally:
+                        await asyncio.to_thread(Path(archive_path).unlink, missing_ok=True)
+                if not downloaded:
+                    await self.set_state(AgentState.RUNNING, f"Cloning GitHub repository: {github_link}")
+                    try:
+                        clone_dir = os.path.join(temp_dir, "repo")
+                        await asyncio.to_thread(Repo.clone_from, github_link, clone_dir, depth=1)
+                        await self.set_state(AgentState.RUNNING, f"Successfully cloned repository: {github_link}")
+                    except Exception as e:
+                        await self.set_state(AgentState.FAILED, f"Failed to clone GitHub repo: {str(e)}")
+                        raise HTTPException(status_code=400, detail=f"Failed to clone GitHub repo: {str(e)}")
+                for file_info in await asyncio.to_thread(find_vb6_files, temp_dir):
+                    publish(file_info["path"])
             if not vb6_files:
                 await self.set_state(AgentState.FAILED, "No VB6 files (.frm, .bas, .cls, .vbp) found")
                 raise HTTPException(status_code=400, detail="No VB6 files (.frm, .bas, .cls, .vbp) found")
@@ -1479,11 +2091,14 @@ class IngestorAgent(BaseAgent):
         except Exception as e:
             await self.set_state(AgentState.FAILED, f"IngestorAgent failed: {str(e)}")
             raise
+        finally:
+            if queue is not None:
+                queue.put_nowait(None)
 
 class ParserAgent(BaseAgent):
     def __init__(self):
         super().__init__("ParserAgent")
-        self.parser = ParserModule()
+        self.parser = parser_module
         self._parsing_started = False
 
     async def run(self, file_info: dict, conversion_id: str = None) -> dict:
@@ -1494,12 +2109,12 @@ class ParserAgent(BaseAgent):
             self._parsing_started = True
         await self.set_state(AgentState.RUNNING, f"Parsing file: {file_name}")
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                code = f.read()
+            async with aiofiles.open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                code = await f.read()
             if len(code) > MAX_CODE_LENGTH:
                 logger.warning(f"Truncating large file: {file_name} ({len(code)} -> {MAX_CODE_LENGTH} chars)", extra={"stage": "parser"})
                 code = code[:MAX_CODE_LENGTH]
-            result = await asyncio.to_thread(self.parser.forward, code, file_name)
+            result = await self.parser.forward(code, file_name)
             result['metadata'] = result.get('metadata', {})
             result['metadata']['file_name'] = file_name
             if file_name.lower().endswith('.frm'):
@@ -1519,12 +2134,12 @@ class ParserAgent(BaseAgent):
 class ContextAnalyzerAgent(BaseAgent):
     def __init__(self):
         super().__init__("ContextAnalyzerAgent")
-        self.analyzer = ContextAnalyzerModule()
+        self.analyzer = context_analyzer_module
 
     async def run(self, parsed_results: List[dict], conversion_id: str = None) -> dict:
         await self.set_state(AgentState.RUNNING, "Running context analysis")
         try:
-            result = await asyncio.to_thread(self.analyzer.forward, parsed_results)
+            result = await self.analyzer.forward(parsed_results)
             await self.set_state(AgentState.COMPLETED, "Successfully analyzed application context")
             return result
         except Exception as e:
@@ -1538,51 +2153,50 @@ class SummarizerAgent(BaseAgent):
     async def run(self, parsed_results: List[dict], conversion_id: str = None) -> str:
         await self.set_state(AgentState.RUNNING, "Starting summarization")
         try:
-            valid_results = [r for r in parsed_results if isinstance(r, dict)]
-            summary = {
-                'procedures': [],
-                'events': [],
-                'globals': [],
-                'dependencies': [],
-                'main_logic': {},
-                'metadata': {},
-                'file_count': len(valid_results)
-            }
-            for result in valid_results:
-                summary['procedures'].extend(result.get('procedures', []))
-                summary['events'].extend(result.get('events', []))
-                summary['globals'].extend(result.get('globals', []))
-                summary['dependencies'].extend(result.get('dependencies', []))
-                main_logic = result.get('main_logic', {})
-                if main_logic:
-                    summary['main_logic'].update(main_logic)
+            procedures, events, globals_list = [], [], []
+            main_logic, metadata_by_file = {}, {}
+            unique_deps = {}  # Insertion-ordered set of dependency names
+            for result in parsed_results:
+                procedures += result.get('procedures', ())
+                events += result.get('events', ())
+                globals_list += result.get('globals', ())
+                for dep in result.get('dependencies', ()):
+                    dep_name = dep.get('name') if isinstance(dep, dict) else str(dep)
+                    if dep_name:
+                        unique_deps.setdefault(dep_name, None)
+                if result_logic := result.get('main_logic'):
+                    main_logic.update(result_logic)
                 metadata = result.get('metadata', {})
                 if metadata.get('file_name'):
-                    summary['metadata'][metadata['file_name']] = metadata
-            deps = summary.get('dependencies', [])
-            unique_deps = []
-            seen = set()
-            for dep in deps:
-                dep_name = dep.get('name') if isinstance(dep, dict) else str(dep)
-                if dep_name and dep_name not in seen:
-                    unique_deps.append(dep_name)
-                    seen.add(dep_name)
-            summary['dependencies'] = unique_deps
+                    metadata_by_file[metadata['file_name']] = metadata
+            summary = {
+                'procedures': procedures,
+                'events': events,
+                'globals': globals_list,
+                'dependencies': list(unique_deps),
+                'main_logic': main_logic,
+                'metadata': metadata_by_file,
+                'file_count': len(parsed_results)
+            }
             await self.set_state(AgentState.COMPLETED, f"Created summary: {len(summary['procedures'])} procedures, {len(summary['events'])} events, {len(summary['globals'])} globals")
-            return yaml.dump(summary, sort_keys=False, default_flow_style=False)
+            return yaml.dump(summary, Dumper=YAML_DUMPER, sort_keys=False, default_flow_style=False)
         except Exception as e:
             await self.set_state(AgentState.FAILED, f"Summarizer error: {str(e)}")
-            return yaml.dump({'procedures': [], 'events': [], 'globals': [], 'dependencies': [], 'main_logic': {}, 'metadata': {}, 'file_count': 0})
+            return EMPTY_SUMMARY_YAML
 
 class GeneratorAgent(BaseAgent):
     def __init__(self):
         super().__init__("GeneratorAgent")
-        self.generator = GeneratorModule()
+        self.generator = generator_module
 
     async def run(self, yaml_summary: str, context_map: dict, conversion_id: str = None) -> dict:
         await self.set_state(AgentState.RUNNING, "Running code generation")
         try:
-            result = await asyncio.to_thread(self.generator.forward, yaml_summary, context_map)
+            if generator_pool is not None:
+                # Concurrent conversions generate on separate cores instead of contending for this process's GIL
+                result = await asyncio.get_running_loop().run_in_executor(generator_pool, generate_in_process, yaml_summary, context_map)
+            else:
+                result = await asyncio.to_thread(self.generator.forward, yaml_summary, context_map)
             await self.set_state(AgentState.COMPLETED, "Successfully generated C# project files")
             return result
         except Exception as e:
@@ -1593,32 +2207,37 @@ class FileBuilderAgent(BaseAgent):
     def __init__(self):
         super().__init__("FileBuilderAgent")
 
-    async def run(self, code_files: dict, conversion_id: str = None) -> bytes:
+    async def run(self, code_files: dict, conversion_id: str = None) -> str:
         await self.set_state(AgentState.RUNNING, "Starting file building")
         try:
-            with tempfile.TemporaryDirectory() as project_dir:
-                properties_dir = os.path.join(project_dir, "Properties")
-                os.makedirs(properties_dir, exist_ok=True)
-                for filename, content in code_files.items():
-                    filepath = os.path.join(project_dir, filename.replace("__", "/"))
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                buffer = io.BytesIO()
-                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for root, _, files in os.walk(project_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arc_path = os.path.relpath(file_path, project_dir)
-                            zip_file.write(file_path, arc_path)
-                buffer.seek(0)
-                await self.set_state(AgentState.COMPLETED, f"Successfully built project ZIP with {len(code_files)} files")
-                return buffer.read()
+            # Build the archive at its final location; the .part suffix keeps /download from seeing it half-written
+            output_path = OUTPUT_DIR / f"{conversion_id or uuid.uuid4()}.zip"
+            part_path = output_path.with_name(output_path.name + ".part")
+            try:
+                await asyncio.to_thread(self._write_zip, code_files, part_path)
+                await aiofiles.os.replace(part_path, output_path)
+            except BaseException:
+                await asyncio.to_thread(part_path.unlink, missing_ok=True)
+                raise
+            await self.set_state(AgentState.COMPLETED, f"Successfully built project ZIP with {len(code_files)} files")
+            return str(output_path)
         except Exception as e:
             await self.set_state(AgentState.FAILED, f"File builder error: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Project building failed: {str(e)}")
 
+    def _write_zip(self, code_files: dict, zip_path: Path):
+        # Generated sources go straight from memory into the archive, with no staging directory to write and read back.
+        # Deflate rather than zstd: zstd entries can't be opened by Explorer
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL) as zip_file:
+            # Keys are already archive paths (see PROJECT_FILE_NAMES)
+            for arcname, content in code_files.items():
+                zip_file.writestr(arcname, content)
+
 class MCP:
+    """One conversion pipeline. Agents carry per-run state, so create an MCP per conversion; the
+    expensive pieces (DSPy modules, LM client, pools, log broker) are module-level and shared."""
+    CONVERSION_TIMEOUT_SECONDS = CONVERSION_TIMEOUT_SECONDS
+
     def __init__(self):
         self.ingestor = IngestorAgent()
         self.parser = ParserAgent()
@@ -1626,40 +2245,96 @@ class MCP:
         self.summarizer = SummarizerAgent()
         self.generator = GeneratorAgent()
         self.filebuilder = FileBuilderAgent()
-        self.log_queue = sse_handler.queue
+        self.logger = logger
+        self.sse_handler = sse_handler
+        self.log_broker = sse_handler.broker
+        self._artifacts = conversion_artifacts
+
+    def is_openai_configured(self) -> bool:
+        return bool(AZURE_OPENAI_API_KEY)
+
+    async def cleanup_partial(self, conversion_id: str):
+        """Remove whatever a cancelled or failed conversion left behind in OUTPUT_DIR."""
+        self._artifacts.pop(conversion_id, None)
+        for leftover in (OUTPUT_DIR / f"{conversion_id}.zip.part", OUTPUT_DIR / f"{conversion_id}.zip"):
+            try:
+                await asyncio.to_thread(leftover.unlink, missing_ok=True)
+            except OSError as e:
+                logger.error(f"Failed to remove partial output {leftover}: {e}", extra={"stage": "cleanup"})
+
+    async def run(self, zip_source: Optional[Union[str, BinaryIO]], github_link: Optional[str], conversion_id: str = None) -> Tuple[str, str]:
+        """Run the pipeline on a ZIP (path or spooled upload) or a GitHub link and return (OUTPUT_DIR/<conversion_id>.zip, conversion_id)."""
+        conversion_id = conversion_id or str(uuid.uuid4())
+        # Tags every event logged for this run (worker threads included) so /stream can follow one conversion
+        context_token = current_conversion_id.set(conversion_id)
+        self.log_broker.reopen(conversion_id)
+        try:
+            return await self._run_pipeline(zip_source, github_link, conversion_id)
+        finally:
+            current_conversion_id.reset(context_token)
 
-    async def run(self, zip_file: Optional[UploadFile], github_link: Optional[str],conversion_id: str = None) -> bytes:
+    async def _run_pipeline(self, zip_source: Optional[Union[str, BinaryIO]], github_link: Optional[str], conversion_id: str) -> Tuple[str, str]:
         with tempfile.TemporaryDirectory() as temp_dir:
             await self.set_pipeline_state(AgentState.RUNNING, "Starting VB6 to .NET conversion pipeline")
             try:
                 if conversion_id and conversion_id in conversion_status:
                     conversion_status[conversion_id].start_step("ingestor")
-                files = await self.ingestor.run(zip_file, github_link, temp_dir, conversion_id)
-                await self.set_pipeline_state(AgentState.RUNNING, f"Processing {len(files)} VB6 files")
-                if conversion_id and conversion_id in conversion_status:
-                    conversion_status[conversion_id].complete_step("ingestor")
                     conversion_status[conversion_id].start_step("parser")
-                files_to_process = files[:MAX_FILES]
+                # The ingestor feeds files to the parse workers as it finds them, so parsing overlaps extraction
+                file_queue = asyncio.Queue()
+                parsed_by_index = {}
+
+                async def parse_worker():
+                    while (item := await file_queue.get()) is not None:
+                        index, file_info = item
+                        parsed_by_index[index] = await self.parser.run(file_info, conversion_id)
+                    file_queue.put_nowait(None)  # Pass the sentinel on to the next worker
+
+                tasks = [asyncio.create_task(self.ingestor.run(zip_source, github_link, temp_dir, conversion_id, file_queue))]
+                tasks += [asyncio.create_task(parse_worker()) for _ in range(PARSER_CONCURRENCY)]
+                try:
+                    files, *_ = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
                 if len(files) > MAX_FILES:
-                    logger.warning(f"Processing only first {MAX_FILES} files out of {len(files)} total", extra={"stage": "pipeline"})
-                parsed_results = await asyncio.gather(*[self.parser.run(f,conversion_id) for f in files_to_process])
+                    logger.warning(f"Processed only first {MAX_FILES} files out of {len(files)} total", extra={"stage": "pipeline"})
+                # Discovery order, not completion order, so the downstream prompts (and their cache keys) are stable.
+                # Validated once here for both the context analyzer and the summarizer.
+                parsed_results = [result for index in sorted(parsed_by_index) if isinstance(result := parsed_by_index[index], dict)]
+                await self.set_pipeline_state(AgentState.RUNNING, f"Parsed {len(parsed_results)} VB6 files")
                 if conversion_id and conversion_id in conversion_status:
+                    conversion_status[conversion_id].complete_step("ingestor")
                     conversion_status[conversion_id].complete_step("parser")
                     conversion_status[conversion_id].start_step("context_analyzer")
-                context_map = await self.context_analyzer.run(parsed_results,conversion_id)
-                yaml_summary = await self.summarizer.run(parsed_results,conversion_id)
+                    conversion_status[conversion_id].start_step("summarizer")
+                # Both need every parsed file, but not each other: summarize while the context LLM call is in flight
+                context_map, yaml_summary = await asyncio.gather(
+                    self.context_analyzer.run(parsed_results, conversion_id),
+                    self.summarizer.run(parsed_results, conversion_id)
+                )
+                if conversion_id and conversion_id in conversion_status:
+                    conversion_status[conversion_id].complete_step("context_analyzer")
+                    conversion_status[conversion_id].complete_step("summarizer")
+                    conversion_status[conversion_id].start_step("generator")
                 code_files = await self.generator.run(yaml_summary, context_map, conversion_id)
                 if conversion_id and conversion_id in conversion_status:
                     conversion_status[conversion_id].complete_step("generator")
                     conversion_status[conversion_id].start_step("filebuilder")
-                result = await self.filebuilder.run(code_files, conversion_id)
+                output_path = await self.filebuilder.run(code_files, conversion_id)
                 if conversion_id and conversion_id in conversion_status:
                     conversion_status[conversion_id].complete_step("filebuilder")
                 await self.set_pipeline_state(AgentState.COMPLETED, "Conversion pipeline completed")
-                return result
+                return output_path, conversion_id
             except Exception as e:
                 await self.set_pipeline_state(AgentState.FAILED, f"Conversion pipeline failed: {str(e)}")
                 raise
+            except asyncio.CancelledError:
+                # Timeouts and client disconnects cancel the run; /stream followers still need its terminal event
+                await self.set_pipeline_state(AgentState.FAILED, "Conversion pipeline cancelled")
+                raise
 
     async def set_pipeline_state(self, state: AgentState, message: str):
         """Emit pipeline-level state updates."""
@@ -1675,6 +2350,21 @@ class MCP:
 
 mcp = MCP()
 
+@app.on_event("startup")
+async def startup():
+    # Known before any client subscribes, so events logged from worker threads are always handed to this loop
+    sse_handler.broker.loop = asyncio.get_running_loop()
+    # Blocking upload/file I/O runs in anyio's threadpool, which defaults to 40 workers
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_MAX_WORKERS
+    app.state.cleanup_task = asyncio.create_task(cleanup_old_files_periodically())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.cleanup_task.cancel()
+    if generator_pool is not None:
+        generator_pool.shutdown(wait=False, cancel_futures=True)
+    await openai_http_client.aclose()
+
 @app.get("/")
 async def root():
     return {
@@ -1689,7 +2379,7 @@ async def health():
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "azure_openai": "configured" if os.getenv("AZURE_OPENAI_API_KEY") else "not configured"
+        "azure_openai": "configured" if AZURE_OPENAI_API_KEY else "not configured"
     }
 
 @app.post("/convert")
@@ -1698,26 +2388,31 @@ async def convert_vb6_project(
     github_link: Optional[str] = Form(None),
     conversion_id: Optional[str] = Form(None)  # Add this parameter
 ):
-    # Generate conversion_id if not provided
-    if not conversion_id:
-        conversion_id = str(uuid.uuid4())
+    # Generate conversion_id if not provided; a client one must be a UUID since it names the output file
+    conversion_id = normalize_conversion_id(conversion_id) if conversion_id else str(uuid.uuid4())
     
     # Initialize status tracking
     conversion_status[conversion_id] = ConversionStatus(conversion_id)
     
     try:
+        # Starlette already spooled the upload; ZipFile reads that file object directly
+        if zip_file:
+            await zip_file.seek(0)
+
         # Run your existing MCP pipeline
-        result_bytes = await mcp.run(zip_file, github_link, conversion_id)  # Pass conversion_id
+        async with admission:
+            output_path, _ = await MCP().run(zip_file.file if zip_file else None, github_link, conversion_id)  # Fresh pipeline per request
         
         # Mark as completed
         conversion_status[conversion_id].completed = True
         conversion_status[conversion_id].overall_progress = 100
         
         # Return the ZIP file as before (keeping your download working)
-        return StreamingResponse(
-            io.BytesIO(result_bytes),
+        return FileResponse(
+            output_path,
             media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=MyWindowsService.zip"}
+            headers={"Content-Disposition": "attachment; filename=MyWindowsService.zip"},
+            background=BackgroundTask(os.unlink, output_path)
         )
         
     except Exception as e:
@@ -1726,60 +2421,32 @@ async def convert_vb6_project(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/convert/stream")
-async def convert_stream():
-    """Stream conversion process updates via SSE"""
+async def convert_stream(conversion_id: Optional[str] = None):
+    """Stream conversion process updates via SSE; pass the conversion_id sent to /convert to follow only that run"""
+    if conversion_id:
+        conversion_id = normalize_conversion_id(conversion_id)
+
     async def event_generator():
         try:
-            while True:
-                try:
-                    log_entry = await asyncio.wait_for(mcp.log_queue.get(), timeout=30.0)
-                    yield {
-                        "event": log_entry["event_type"],
-                        "data": json.dumps({
-                            "message": log_entry["message"],
-                            "timestamp": log_entry["timestamp"],
-                            "stage": log_entry["stage"],
-                            "agent": log_entry["agent"],
-                            "state": log_entry["state"],
-                            "progress": log_entry["progress"],
-                            "details": log_entry["details"],
-                            "level": log_entry["level"]
-                        })
-                    }
-                except asyncio.TimeoutError:
-                    yield {
-                        "event": "keepalive",
-                        "data": json.dumps({
-                            "message": "No new updates",
-                            "timestamp": time.time(),
-                            "progress": sse_handler.progress,
-                            "details": {"stage_progress": 0}
-                        })
-                    }
-                except Exception as e:
-                    logger.error(f"Unexpected error in event generator: {str(e)}", extra={"stage": "streaming"})
-                    yield {
-                        "event": "error",
-                        "data": json.dumps({
-                            "message": f"Streaming error: {str(e)}",
-                            "timestamp": time.time(),
-                            "progress": sse_handler.progress,
-                            "details": {"stage_progress": 0}
-                        })
-                    }
-        except GeneratorExit:
-            logger.info("SSE connection closed by client", extra={"stage": "streaming"})
+            async for log_entry in mcp.log_broker.stream(conversion_id):
+                yield {
+                    "event": log_entry.event_type,
+                    "data": sse_encoder.encode(log_entry).decode()
+                }
+        except Exception as e:
+            logger.error(f"Unexpected error in event generator: {str(e)}", extra={"stage": "streaming"})
             yield {
-                "event": "connection_closed",
-                "data": json.dumps({
-                    "message": "Client disconnected",
+                "event": "error",
+                "data": orjson.dumps({
+                    "message": f"Streaming error: {str(e)}",
                     "timestamp": time.time(),
                     "progress": sse_handler.progress,
                     "details": {"stage_progress": 0}
-                })
+                }).decode()
             }
 
-    return EventSourceResponse(event_generator(), headers={"Cache-Control": "no-cache"})
+    # Keep-alives are sent by EventSourceResponse as ": ping" comments
+    return EventSourceResponse(event_generator(), ping=15, headers={"Cache-Control": "no-cache"})
 
 if __name__ == "__main__":
     import uvicorn
@@ -1787,5 +2454,8 @@ if __name__ == "__main__":
         app, 
         host="0.0.0.0", 
         port=8000,
-        log_level="info"
+        log_level="info",
+        loop="auto",  # uvloop when installed (not available on Windows)
+        http="auto",  # httptools when installed
+        access_log=False
     )
\ No newline at end of file
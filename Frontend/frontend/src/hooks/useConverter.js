@@ -55,8 +55,11 @@ export function useConverter() {
     setDuration(null);
 
     try {
-      console.log('Attempting to connect to SSE:', `${apiUrl}/stream`);
-      eventSourceRef.current = new EventSource(`${apiUrl}/stream`);
+      // Chosen up front so the stream only carries this conversion's events (randomUUID needs a secure context)
+      const requestedId = window.crypto?.randomUUID?.() ?? null;
+      const streamUrl = requestedId ? `${apiUrl}/stream?conversion_id=${requestedId}` : `${apiUrl}/stream`;
+      console.log('Attempting to connect to SSE:', streamUrl);
+      eventSourceRef.current = new EventSource(streamUrl);
       eventSourceRef.current.onopen = () => {
         console.log('SSE connection opened');
       };
@@ -102,6 +105,9 @@ export function useConverter() {
       });
 
       const formData = new FormData();
+      if (requestedId) {
+        formData.append('conversion_id', requestedId);
+      }
       if (file) {
         formData.append('zip_file', file);
       } else if (githubUrl) {